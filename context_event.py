@@ -0,0 +1,40 @@
+import time
+
+
+class ContextEventCache():
+    """
+    Remembers what the context menu commands resolved for the last mouse event,
+    as Sublime Text calls their is_visible, description and run with the same
+    event. The event is identified by the view, its change count and the text
+    point clicked, as the same window coordinates point to other text once the
+    view is scrolled. As a later right-click on the same point is identified
+    the same, the values expire after EXPIRY seconds and once a command runs.
+    """
+
+    EXPIRY = 1.0
+
+    event_key = None
+    event_time = 0
+    values = {}
+
+    @classmethod
+    def get(cls, view, event, name, resolve):
+        """ Returns resolve(), calling it once per event and name """
+        event_key = (view.id(), view.change_count(), view.window_to_text((event["x"], event["y"])))
+        now = time.monotonic()
+
+        if event_key != cls.event_key or now - cls.event_time > cls.EXPIRY:
+            cls.event_key = event_key
+            cls.event_time = now
+            cls.values = {}
+
+        if name not in cls.values:
+            cls.values[name] = resolve()
+
+        return cls.values[name]
+
+    @classmethod
+    def clear(cls):
+        """ Forgets the values, called once the context menu command runs """
+        cls.event_key = None
+        cls.values = {}
@@ -1,25 +1,49 @@
+import array
 import collections
+import fnmatch
 import functools
+import heapq
 import html
+import json
+import math
 import os
 import subprocess
 import sys
 
 import re
+import select
 import threading
 import time
 import codecs
 import signal
 import datetime
+import errno
 
 import sublime
 import sublime_plugin
 
+try:
+    import pty as pseudo_terminal
+
+except ImportError:
+    # Windows has no pseudo-terminals
+    pseudo_terminal = None
+
 g_last_scroll_positions = {}
 
 g_last_click_time = time.time()
 g_last_click_buttons = None
 
+# Window id to the list of file patterns which trigger a build when saved
+g_watch_patterns = {}
+g_watch_generation = {}
+
+# Ids of the windows whose last build has errors with phantoms to show
+g_windows_with_errors = set()
+
+# View id to the (row, column) to show after the view finishes loading
+g_pending_navigations = {}
+
 try:
     from FixedToggleFindPanel.fixed_toggle_find_panel import is_panel_focused
 
@@ -40,6 +64,10 @@ def get_panel_view(window, panel_name ):
             window.find_output_panel( get_panel_name( panel_name ) )
 
 
+def normalize_path(path):
+    return os.path.normcase( os.path.normpath( path ) )
+
+
 # https://forum.sublimetext.com/t/how-to-set-focus-to-exec-output-panel/26689/5
 # https://forum.sublimetext.com/t/how-to-track-if-an-output-panel-is-closed-hidden/8453/6
 class ExecOutputFocusCancelBuildCommand(sublime_plugin.WindowCommand):
@@ -154,13 +182,18 @@ class FullRegexListener(sublime_plugin.EventListener):
 
                             print( '[exec] Opening', filename, line, column, 'file', filepath, real_dir_file )
 
-                            fileview = window.open_file(
-                                filepath + ":" + line + ":" + column,
-                                sublime.ENCODED_POSITION | sublime.FORCE_GROUP
-                            )
+                            if view.settings().get( 'result_restore_view_navigation', False ):
+                                fileview = window.open_file(
+                                    filepath + ":" + line + ":" + column,
+                                    sublime.ENCODED_POSITION | sublime.FORCE_GROUP
+                                )
+
+                                # https://github.com/SublimeTextIssues/Core/issues/2506
+                                restore_view( fileview, window, lambda: None )
+
+                            else:
+                                navigate_to_position( window, filepath, int( line or 0 ), int( column or 0 ) )
 
-                            # https://github.com/SublimeTextIssues/Core/issues/2506
-                            restore_view( fileview, window, lambda: None )
                             window.set_view_index( active_view, group, view_index )
 
                             # window.focus_group( group )
@@ -174,9 +207,17 @@ class ProcessListener(object):
     def on_data(self, proc, data):
         pass
 
+    def on_error_data(self, proc, data):
+        """ Called with the stderr output, by default merged with stdout """
+        self.on_data(proc, data)
+
     def on_finished(self, proc):
         pass
 
+    def on_error_finished(self, proc):
+        """ Called once the stderr output has been read, when kept separate """
+        pass
+
 
 class AsyncProcess(object):
     """
@@ -184,8 +225,32 @@ class AsyncProcess(object):
     ProcessListener (on a separate thread)
     """
 
-    def __init__(self, cmd, shell_cmd, env, listener, path="", shell=False):
-        """ "path" and "shell" are options in build systems """
+    WRITE_SIZE = 2**16
+
+    # Seconds to wait after SIGTERM before sending SIGKILL to the process group
+    KILL_GRACE_PERIOD = 2
+
+    # Seconds the reader threads keep draining the pipes after SIGKILL, as they
+    # may be held open by grandchildren which left the process group
+    DRAIN_TIMEOUT = 0.5
+    READ_POLL_INTERVAL = 0.1
+
+    def __init__(self, cmd, shell_cmd, env, listener, path="", shell=False, stdin_data=None,
+            timeout=None, max_output_size=None, pty=False, pty_stderr="merged"):
+        """ "path" and "shell" are options in build systems
+
+        "stdin_data" is an optional string streamed into the process stdin
+        from a writer thread, so the pipes are never deadlocked while the
+        reader threads consume stdout and stderr.
+
+        "timeout" in seconds and "max_output_size" in bytes are optional
+        limits, the process group is killed when one of them is reached.
+
+        "pty" runs the process under a pseudo-terminal on Linux and OSX, so
+        it line buffers its output as when run from a terminal. Its stderr
+        is also written to the terminal when "pty_stderr" is "merged", or
+        kept on a separate pipe when it is "separate".
+        """
 
         if not shell_cmd and not cmd:
             raise ValueError("shell_cmd or cmd is required")
@@ -195,6 +260,18 @@ class AsyncProcess(object):
 
         self.listener = listener
         self.killed = False
+        # The marker of the limit the process was killed on, if any
+        self.limit_reached = None
+        self.kill_time = None
+        self.drain_deadline = None
+
+        self.readers = 0
+        self.readers_lock = threading.Lock()
+
+        self.max_output_size = max_output_size
+        self.output_size = 0
+        self.output_size_lock = threading.Lock()
+        self.timeout_timer = None
 
         self.start_time = time.time()
 
@@ -221,12 +298,26 @@ class AsyncProcess(object):
         else:
             preexec_fn = os.setsid
 
+        stdout = subprocess.PIPE
+        stderr = subprocess.PIPE
+        master_fd = None
+
+        if pty and pseudo_terminal is None:
+            print("[exec] Pseudo-terminals are not supported on this platform, using pipes")
+
+        elif pty:
+            master_fd, slave_fd = pseudo_terminal.openpty()
+            stdout = slave_fd
+
+            if pty_stderr == "merged":
+                stderr = slave_fd
+
         if shell_cmd and sys.platform == "win32":
             # Use shell=True on Windows, so shell_cmd is passed through with the correct escaping
             self.proc = subprocess.Popen(
                 shell_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
                 stdin=subprocess.PIPE,
                 startupinfo=startupinfo,
                 env=proc_env,
@@ -235,8 +326,8 @@ class AsyncProcess(object):
             # Use a login shell on OSX, otherwise the users expected env vars won't be setup
             self.proc = subprocess.Popen(
                 ["/usr/bin/env", "bash", "-l", "-c", shell_cmd],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
                 stdin=subprocess.PIPE,
                 startupinfo=startupinfo,
                 env=proc_env,
@@ -248,8 +339,8 @@ class AsyncProcess(object):
             # linux, as it's not required
             self.proc = subprocess.Popen(
                 ["/usr/bin/env", "bash", "-c", shell_cmd],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
                 stdin=subprocess.PIPE,
                 startupinfo=startupinfo,
                 env=proc_env,
@@ -260,8 +351,8 @@ class AsyncProcess(object):
             # Old style build system, just do what it asks
             self.proc = subprocess.Popen(
                 cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
                 stdin=subprocess.PIPE,
                 startupinfo=startupinfo,
                 env=proc_env,
@@ -271,21 +362,52 @@ class AsyncProcess(object):
         if path:
             os.environ["PATH"] = old_path
 
-        if self.proc.stdout:
+        if master_fd is not None:
+            # Only the child holds the slave end, so reading the master
+            # reaches the end of file as soon as the child closes it
+            os.close(slave_fd)
+            self.start_reader(master_fd, None, True)
+
+        if timeout:
+            self.timeout_timer = threading.Timer(
+                timeout,
+                self.kill_on_limit,
+                args=("[Timed out after %ss, the process was killed]" % timeout,))
+            self.timeout_timer.daemon = True
+            self.timeout_timer.start()
+
+        if stdin_data is not None:
             threading.Thread(
-                target=self.read_fileno,
-                args=(self.proc.stdout.fileno(), True)
+                target=self.write_stdin,
+                args=(stdin_data.encode(self.listener.encoding),)
             ).start()
 
+        if self.proc.stdout:
+            self.start_reader(self.proc.stdout.fileno(), self.proc.stdout, True)
+
         if self.proc.stderr:
-            threading.Thread(
-                target=self.read_fileno,
-                args=(self.proc.stderr.fileno(), False)
-            ).start()
+            self.start_reader(self.proc.stderr.fileno(), self.proc.stderr, False)
+
+    def start_reader(self, fileno, stream, execute_finished):
+        """ Reads fileno on a new thread, closing it through stream when it owns it """
+        with self.readers_lock:
+            self.readers += 1
+
+        threading.Thread(
+            target=self.read_fileno,
+            args=(fileno, stream, execute_finished)
+        ).start()
 
     def kill(self):
+        """
+        Sends SIGTERM to the process group and SIGKILL after KILL_GRACE_PERIOD.
+        The reader threads stop at most DRAIN_TIMEOUT seconds later, even if
+        the pipes are still held open by some grandchild process.
+        """
         if not self.killed:
             self.killed = True
+            self.kill_time = time.monotonic()
+            self.drain_deadline = self.kill_time + self.KILL_GRACE_PERIOD + self.DRAIN_TIMEOUT
             if sys.platform == "win32":
                 # terminate would not kill process opened by the shell cmd.exe,
                 # it will only kill cmd.exe leaving the child running
@@ -295,34 +417,143 @@ class AsyncProcess(object):
                     "taskkill /PID %d /T /F" % self.proc.pid,
                     startupinfo=startupinfo)
             else:
-                os.killpg(self.proc.pid, signal.SIGTERM)
-                self.proc.terminate()
+                try:
+                    os.killpg(self.proc.pid, signal.SIGTERM)
+                    self.proc.terminate()
+                except OSError:
+                    # The process already exited
+                    pass
+
+                force_timer = threading.Timer(self.KILL_GRACE_PERIOD, self.force_kill)
+                force_timer.daemon = True
+                force_timer.start()
             self.listener = None
 
+            if self.timeout_timer:
+                self.timeout_timer.cancel()
+
+    def force_kill(self):
+        """ Kills the process group, even when it ignores SIGTERM """
+        if sys.platform != "win32":
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                # The whole group already exited
+                pass
+
+    def kill_on_limit(self, marker):
+        listener = self.listener
+        if self.killed or not listener:
+            return
+
+        self.limit_reached = marker
+        self.kill()
+        listener.on_data(self, "\n" + marker + "\n")
+        listener.on_finished(self)
+
     def poll(self):
         return self.proc.poll() is None
 
     def exit_code(self):
         return self.proc.poll()
 
-    def read_fileno(self, fileno, execute_finished):
+    def write_stdin(self, data):
+        stdin = self.proc.stdin
+        try:
+            for start in range(0, len(data), self.WRITE_SIZE):
+                if self.killed:
+                    break
+                stdin.write(data[start:start + self.WRITE_SIZE])
+                stdin.flush()
+        except (BrokenPipeError, OSError):
+            # The process exited or closed its stdin before reading everything
+            pass
+        finally:
+            try:
+                stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+    def read_fileno(self, fileno, stream, execute_finished):
         decoder_cls = codecs.getincrementaldecoder(self.listener.encoding)
         decoder = decoder_cls('replace')
         while True:
-            data = decoder.decode(os.read(fileno, 2**16))
+            raw = self.read_chunk(fileno)
+            if raw is None:
+                continue
+
+            if self.max_output_size and raw:
+                with self.output_size_lock:
+                    self.output_size += len(raw)
+                    exceeded = self.output_size > self.max_output_size
+
+                if exceeded:
+                    self.kill_on_limit(
+                        "[Output exceeded %d bytes, the process was killed]" % self.max_output_size)
+
+            data = decoder.decode(raw)
+            listener = self.listener
 
             if len(data) > 0:
-                if self.listener:
-                    self.listener.on_data(self, data)
-            else:
+                if listener:
+                    if execute_finished:
+                        listener.on_data(self, data)
+                    else:
+                        listener.on_error_data(self, data)
+            elif not raw:
+                # Close the pipes through their file objects, which would
+                # otherwise close the same descriptor numbers again when
+                # collected, after newer processes may have reused them
                 try:
-                    os.close(fileno)
+                    if stream:
+                        stream.close()
+                    else:
+                        os.close(fileno)
                 except OSError:
                     pass
-                if execute_finished and self.listener:
-                    self.listener.on_finished(self)
+                if execute_finished:
+                    if self.timeout_timer:
+                        self.timeout_timer.cancel()
+                    if listener:
+                        listener.on_finished(self)
+                elif listener:
+                    listener.on_error_finished(self)
                 break
 
+        with self.readers_lock:
+            self.readers -= 1
+            is_idle = self.readers == 0
+
+        if is_idle and self.kill_time is not None:
+            print("[exec] Cancelled process %d is idle after %.0f ms" % (
+                    self.proc.pid, (time.monotonic() - self.kill_time) * 1000))
+
+    def read_chunk(self, fileno):
+        """ Returns the next chunk read from the file descriptor, an empty string
+        at the end of file, or None when nothing arrived in READ_POLL_INTERVAL """
+        if self.killed and time.monotonic() > self.drain_deadline:
+            # Give up on pipes held open by grandchildren which left the process
+            # group, whether or not they are still writing to them
+            return b""
+
+        if sys.platform != "win32":
+            try:
+                readable, _, _ = select.select([fileno], [], [], self.READ_POLL_INTERVAL)
+            except InterruptedError:
+                return None
+
+            if not readable:
+                return None
+
+        try:
+            return os.read(fileno, 2**16)
+        except OSError as error:
+            # Linux raises EIO when reading a pseudo-terminal master
+            # after the slave end was closed by the child
+            if error.errno == errno.EIO:
+                return b""
+            raise
+
 
 class FixSublimeTextOutputBuild(sublime_plugin.WindowCommand):
 
@@ -507,12 +738,40 @@ class ExecRestoreOutputViewScrollingHelperCommand(sublime_plugin.TextCommand):
             view.set_viewport_position( ( 0, viewport_position[1] ) )
 
 
+def navigate_to_position(window, file_path, row, column):
+    """ Opens the file at the 1-based row and column, setting the selection and
+    the viewport once, as soon as the file is loaded. """
+    view = window.open_file(
+        "%s:%d:%d" % ( file_path, row, column ),
+        sublime.ENCODED_POSITION | sublime.FORCE_GROUP
+    )
+
+    if view.is_loading():
+        g_pending_navigations[view.id()] = ( row, column )
+
+    else:
+        show_position( view, row, column )
+
+    return view
+
+
+def show_position(view, row, column):
+    point = view.text_point( max( row - 1, 0 ), max( column - 1, 0 ) )
+
+    view.sel().clear()
+    view.sel().add( sublime.Region( point ) )
+    view.show_at_center( point )
+
+
 TIME_AFTER_FOCUS_VIEW = 30
 TIME_AFTER_RESTORE_VIEW = 15
 
 def restore_view(view, window, next_target, withfocus=True):
     """ Taken from the https://github.com/evandrocoan/FixProjectSwitchRestartBug package
     Because on Linux, set_viewport was not restoring the scroll.
+
+    Result navigation uses navigate_to_position() instead, this chain is only used
+    when the `result_restore_view_navigation` setting is enabled.
     """
 
     if view.is_loading():
@@ -563,6 +822,95 @@ def restore_view(view, window, next_target, withfocus=True):
                 sublime.set_timeout( super_refocus, TIME_AFTER_RESTORE_VIEW )
 
 
+class BuildHistory(object):
+    """
+    Stores the duration, exit code, output size and errors count of the last
+    builds of each project and build command, in a file on the cache path.
+    Builds killed on a limit are flagged and left out of the durations.
+    """
+    MAX_ENTRIES = 100
+
+    # Alerts when a build takes this much longer than the median of its last runs
+    SLOWDOWN_RATIO = 1.5
+    SLOWDOWN_MINIMUM = 1.0
+    SLOWDOWN_MINIMUM_RUNS = 5
+
+    history = None
+    lock = threading.Lock()
+
+    @classmethod
+    def file_path(cls):
+        return os.path.join(sublime.cache_path(), "exec_build_history.json")
+
+    @classmethod
+    def load(cls):
+        if cls.history is None:
+            try:
+                with open(cls.file_path(), 'r', encoding='utf-8') as history_file:
+                    cls.history = json.load(history_file)
+            except (OSError, ValueError):
+                cls.history = {}
+        return cls.history
+
+    @classmethod
+    def save(cls):
+        with cls.lock:
+            data = json.dumps(cls.history, separators=(',', ':'))
+
+        temporary_path = cls.file_path() + ".tmp"
+        with open(temporary_path, 'w', newline='\n', encoding='utf-8') as history_file:
+            history_file.write(data)
+        os.replace(temporary_path, cls.file_path())
+
+    @classmethod
+    def add(cls, key, duration, exit_code, output_size, errors_count, killed=False):
+        """ Returns the durations of the previous builds with the same key """
+        with cls.lock:
+            entries = cls.load().setdefault(key, [])
+            durations = cls.durations(entries)
+
+            entries.append([int(time.time()), round(duration, 3), exit_code, output_size, errors_count, killed])
+            del entries[:-cls.MAX_ENTRIES]
+
+        sublime.set_timeout_async(cls.save, 0)
+        return durations
+
+    @classmethod
+    def entries(cls, key_prefix=""):
+        with cls.lock:
+            return [(key, list(entries)) for key, entries in cls.load().items() if key.startswith(key_prefix)]
+
+    @staticmethod
+    def durations(entries):
+        """ Returns the durations of the entries which were not killed on a limit """
+        # Entries recorded before the killed flag was added have 5 fields
+        return [entry[1] for entry in entries if len(entry) < 6 or not entry[5]]
+
+    @staticmethod
+    def statistics(durations):
+        """ Returns the median and the 90th percentile of the durations """
+        durations = sorted(durations)
+        middle = len(durations) // 2
+
+        if len(durations) % 2:
+            median = durations[middle]
+        else:
+            median = (durations[middle - 1] + durations[middle]) / 2
+
+        p90 = durations[int(math.ceil(0.9 * len(durations))) - 1]
+        return median, p90
+
+    @classmethod
+    def slowdown_message(cls, duration, durations):
+        if len(durations) < cls.SLOWDOWN_MINIMUM_RUNS:
+            return ""
+
+        median = cls.statistics(durations)[0]
+        if duration > median * cls.SLOWDOWN_RATIO and duration - median > cls.SLOWDOWN_MINIMUM:
+            return ", took %.1fs instead of the usual %.1fs" % (duration, median)
+        return ""
+
+
 class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
     BLOCK_SIZE = 2**14
     text_queue = collections.deque()
@@ -572,9 +920,28 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
     proc = None
 
     errs_by_file = {}
+    errs_files_by_path = {}
     phantom_sets_by_buffer = {}
     show_errors_inline = True
 
+    last_run_args = None
+    watch_pending = False
+
+    # Monotonic arrival time of each output line, when line_timestamps is enabled
+    line_times = None
+    line_times_start = 0
+    SLOWEST_LINES_COUNT = 20
+
+    # Result regexes checked against each output line with a time budget
+    guarded_regexes = []
+    disabled_regexes = []
+    max_line_length = None
+    current_line = ""
+    current_line_length = 0
+    line_truncated = False
+    guard_lock = threading.Lock()
+    LINEAR_REGEX_CHARACTER_TIME = 1e-6
+
     def run(
             self,
             cmd=None,
@@ -587,7 +954,10 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
             quiet=False,
             kill=False,
             update_phantoms_only=False,
+            update_phantoms_file=None,
             hide_phantoms_only=False,
+            show_line_timings=False,
+            show_build_history=False,
             output_build_word_wrap=None,
             spell_check=None,
             gutter=None,
@@ -596,15 +966,36 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
             result_dir="",
             replaceby={},
             always_cancel_output_build_panel=False,
+            timeout=None,
+            max_output_size=None,
+            line_timestamps=None,
+            watch_rerun=None,
             # Catches "path" and "shell"
             **kwargs):
         # print( 'ExecCommand arguments: ', locals())
-        view_settings = self.window.active_view().settings()
-
         if update_phantoms_only:
             if self.show_errors_inline:
-                self.update_phantoms()
+                self.update_phantoms(update_phantoms_file)
+            return
+
+        if show_line_timings:
+            self.show_line_timings()
+            return
+
+        if show_build_history:
+            self.show_build_history()
+            return
+
+        run_args = dict(locals())
+        run_args.update(run_args.pop('kwargs'))
+        del run_args['self']
+
+        if watch_rerun is not None:
+            self.rerun_on_save(watch_rerun)
             return
+
+        view_settings = self.window.active_view().settings()
+
         if hide_phantoms_only:
             self.hide_phantoms()
             return
@@ -615,12 +1006,18 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
             self.text_queue_proc = None
 
         if kill:
+            self.watch_pending = False
             if self.proc:
                 self.proc.kill()
                 self.proc = None
                 self.append_string(None, "[Cancelled]")
             return
 
+        # Reruns from the watch mode with the same arguments reuse the output panel
+        # and its phantoms, instead of creating them again
+        is_rerun = run_args == self.last_run_args and hasattr(self, 'output_view')
+        self.last_run_args = run_args
+
         if not hasattr(self, 'output_view'):
             # Try not to call get_output_panel until the regexes are assigned
             self.output_view = self.window.create_output_panel("exec")
@@ -632,6 +1029,14 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         if output_build_word_wrap is None: output_build_word_wrap = view_settings.get("output_build_word_wrap", False)
         if spell_check is None: spell_check = view_settings.get("build_view_spell_check", False)
         if gutter is None: gutter = view_settings.get("gutter", True)
+        if timeout is None: timeout = view_settings.get("build_timeout", None)
+        if max_output_size is None: max_output_size = view_settings.get("build_max_output_size", None)
+        if line_timestamps is None: line_timestamps = view_settings.get("build_line_timestamps", False)
+
+        self.setup_regexes_guard(
+            view_settings.get("build_max_line_length", 10000),
+            view_settings.get("result_regex_time_budget", 20),
+            (("result_file_regex", file_regex), ("result_line_regex", line_regex), ("result_full_regex", full_regex)))
 
         self.output_view.settings().set("result_full_regex", full_regex)
         self.output_view.settings().set("result_replaceby", replaceby)
@@ -650,9 +1055,13 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         self.output_view.settings().set("scroll_past_end", False)
         self.output_view.assign_syntax(syntax)
 
-        # Call create_output_panel a second time after assigning the above
-        # settings, so that it'll be picked up as a result buffer
-        self.window.create_output_panel("exec")
+        if is_rerun:
+            self.output_view.run_command('exec_clear_output_panel')
+
+        else:
+            # Call create_output_panel a second time after assigning the above
+            # settings, so that it'll be picked up as a result buffer
+            self.window.create_output_panel("exec")
 
         self.encoding = encoding
         self.quiet = quiet
@@ -673,7 +1082,10 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         if show_panel_on_build:
             self.window.run_command("show_panel", {"panel": "output.exec"})
 
-        self.hide_phantoms()
+        if is_rerun:
+            self.clear_phantoms()
+        else:
+            self.hide_phantoms()
         self.show_errors_inline = sublime.load_settings("Preferences.sublime-settings").get("show_errors_inline", True)
 
         merged_env = env.copy()
@@ -687,6 +1099,13 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         if working_dir != "":
             os.chdir(working_dir)
 
+        self.history_key = "%s | %s" % (self.history_project(),
+                shell_cmd or (cmd if isinstance(cmd, str) else " ".join(cmd or [])))
+
+        with self.text_queue_lock:
+            self.line_times = array.array('d') if line_timestamps else None
+            self.line_times_start = time.monotonic()
+
         self.debug_text = ""
         if shell_cmd:
             self.debug_text += "[shell_cmd: " + shell_cmd + "]\n"
@@ -700,7 +1119,8 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
 
         try:
             # Forward kwargs to AsyncProcess
-            self.proc = AsyncProcess(cmd, shell_cmd, merged_env, self, **kwargs)
+            self.proc = AsyncProcess(cmd, shell_cmd, merged_env, self,
+                    timeout=timeout, max_output_size=max_output_size, **kwargs)
 
             with self.text_queue_lock:
                 self.text_queue_proc = self.proc
@@ -718,6 +1138,21 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         else:
             return True
 
+    def rerun_on_save(self, save_time):
+        if not self.last_run_args:
+            return
+
+        if self.proc and self.proc.start_time >= save_time:
+            # A build started after the file was saved, i.e., "Save All on Build"
+            return
+
+        if self.proc and self.proc.poll():
+            # Coalesce all the saves while building into a single run after it
+            self.watch_pending = True
+            return
+
+        self.run(**self.last_run_args)
+
     def append_string(self, proc, str):
         was_empty = False
         with self.text_queue_lock:
@@ -753,6 +1188,9 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
             characters = self.text_queue.popleft()
             is_empty = (len(self.text_queue) == 0)
 
+        while self.disabled_regexes:
+            self.output_view.settings().set(self.disabled_regexes.pop(), "")
+
         self.output_view.run_command(
             'append',
             {'characters': characters, 'force': True, 'scroll_to_end': True})
@@ -765,6 +1203,10 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
                     errs_by_file[file] = []
                 errs_by_file[file].append((line, column, text))
             self.errs_by_file = errs_by_file
+            self.errs_files_by_path = {normalize_path(file): file for file in errs_by_file}
+
+            if errs_by_file:
+                g_windows_with_errors.add(self.window.id())
 
             self.update_phantoms()
 
@@ -775,7 +1217,13 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         elapsed = time.time() - proc.start_time
         exit_code = proc.exit_code()
 
-        if exit_code == 0 or exit_code is None:
+        if proc.limit_reached:
+            # The process may not be reaped yet, its exit code is still None
+            self.append_string(proc, "[Finished in %.1fs, the process was killed]\n" % elapsed)
+
+            if not self.quiet:
+                self.append_string(proc, self.debug_text)
+        elif exit_code == 0 or exit_code is None:
             self.append_string(proc, "[Finished in %.1fs]" % elapsed)
         else:
             self.append_string(proc, "[Finished in %.1fs with exit code %d]\n" % (elapsed, exit_code))
@@ -789,13 +1237,24 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         ThreadProgress.stop()
         errs = self.output_view.find_all_results()
 
-        if len(errs) == 0:
-            sublime.status_message("Build finished")
+        killed = proc.limit_reached is not None
+        durations = BuildHistory.add(
+            self.history_key, elapsed, exit_code, self.output_view.size(), len(errs), killed)
+        slowdown = "" if killed else BuildHistory.slowdown_message(elapsed, durations)
+
+        if killed:
+            sublime.status_message("Build failed, the process was killed")
+        elif len(errs) == 0:
+            sublime.status_message("Build finished" + slowdown)
         else:
-            sublime.status_message("Build finished with %d errors" % len(errs))
+            sublime.status_message("Build finished with %d errors%s" % (len(errs), slowdown))
 
         self.restoreViewPositions()
 
+        if self.watch_pending:
+            self.watch_pending = False
+            self.window.run_command('exec', {'watch_rerun': time.time()})
+
     def restoreViewPositions(self):
         output_view = self.output_view
         output_view.run_command( 'exec_restore_output_view_scrolling_helper' )
@@ -805,12 +1264,194 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
         # in memory.
         data = data.replace('\r\n', '\n').replace('\r', '\n')
 
+        if proc == self.text_queue_proc:
+            data = self.guard_lines(data)
+
+        if self.line_times is not None:
+            now = time.monotonic()
+            lines_count = data.count('\n')
+
+            with self.text_queue_lock:
+                if proc == self.text_queue_proc and self.line_times is not None:
+                    self.line_times.extend([now] * lines_count)
+
         self.append_string(proc, data)
 
     def on_finished(self, proc):
         sublime.set_timeout(functools.partial(self.finish, proc), 0)
 
-    def update_phantoms(self):
+    def setup_regexes_guard(self, max_line_length, time_budget, regexes):
+        with self.guard_lock:
+            self.max_line_length = max_line_length
+            self.regex_time_budget = time_budget / 1000
+            self.current_line = ""
+            self.current_line_length = 0
+            self.line_truncated = False
+            self.disabled_regexes = []
+            self.guarded_regexes = []
+
+            for setting, regex in regexes:
+                if not regex:
+                    continue
+
+                try:
+                    self.guarded_regexes.append((setting, re.compile(regex, re.MULTILINE)))
+                except re.error as error:
+                    # Sublime Text uses Oniguruma, which accepts some syntax Python does not
+                    print("[exec] Could not guard the %s '%s': %s" % (setting, regex, error))
+
+    def guard_lines(self, data):
+        """
+        Truncates the output lines longer than `max_line_length` and checks each
+        complete line against the result regexes, so a regex with catastrophic
+        backtracking is disabled before Sublime Text runs it on the UI thread.
+        """
+        if not self.max_line_length and not self.guarded_regexes:
+            return data
+
+        output = []
+        with self.guard_lock:
+            for index, segment in enumerate(data.split('\n')):
+                if index:
+                    output.append('\n')
+                    self.check_regexes(self.current_line)
+                    self.current_line = ""
+                    self.current_line_length = 0
+                    self.line_truncated = False
+
+                if self.line_truncated:
+                    continue
+
+                # The line length is tracked apart from the text kept for the
+                # regexes, as lines split across reads are only kept while
+                # some regex is guarded
+                if self.max_line_length:
+                    available = self.max_line_length - self.current_line_length
+
+                    if len(segment) > available:
+                        segment = segment[:available]
+                        self.line_truncated = True
+                        output.append(segment + " [line truncated]")
+
+                self.current_line_length += len(segment)
+                if self.guarded_regexes:
+                    self.current_line += segment
+
+                if not self.line_truncated:
+                    output.append(segment)
+
+        return "".join(output)
+
+    def check_regexes(self, line):
+        # Search growing prefixes of the line, so an exponential regex blows the
+        # budget on a short prefix instead of hanging on the whole line. While the
+        # search takes linear time the prefix doubles, otherwise it only grows by
+        # as many characters as an exponential regex could afford in the budget.
+        budget = self.regex_time_budget
+
+        for setting, regex in list(self.guarded_regexes):
+            length = 8
+            total = 0
+
+            while True:
+                start = time.perf_counter()
+                regex.search(line[:length])
+                elapsed = time.perf_counter() - start
+                total += elapsed
+
+                if total > budget:
+                    print("[exec] Disabled the %s '%s' for this build, it took %.0f ms on a %d characters line" % (
+                            setting, regex.pattern, total * 1000, min(length, len(line))))
+
+                    self.guarded_regexes.remove((setting, regex))
+                    self.disabled_regexes.append(setting)
+                    break
+
+                if length >= len(line):
+                    break
+
+                if elapsed < length * self.LINEAR_REGEX_CHARACTER_TIME:
+                    length *= 2
+                else:
+                    length += max(1, int(math.log2(budget / elapsed)) - 1)
+
+    def history_project(self):
+        folders = self.window.folders()
+        return self.window.project_file_name() or (folders[0] if folders else "")
+
+    def show_build_history(self):
+        """ Lists the duration trends of the builds of this project """
+        entries = BuildHistory.entries(self.history_project() + " | ")
+        if not entries:
+            sublime.status_message("No builds recorded for this project")
+            return
+
+        items = []
+        for key, runs in sorted(entries, key=lambda item: -item[1][-1][0]):
+            timestamp, duration, exit_code, output_size, errors_count = runs[-1][:5]
+            killed = len(runs[-1]) > 5 and runs[-1][5]
+            durations = BuildHistory.durations(runs)
+
+            if durations:
+                median, p90 = BuildHistory.statistics(durations)
+                trend = "last %.1fs, median %.1fs, p90 %.1fs over %d runs" % (duration, median, p90, len(durations))
+            else:
+                trend = "last %.1fs, no completed runs" % duration
+
+            items.append([
+                key.split(" | ", 1)[1],
+                trend,
+                "last run %s, %s, %d errors, %d characters" % (
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)),
+                    "killed" if killed else "exit code %s" % exit_code, errors_count, output_size),
+            ])
+
+        self.window.show_quick_panel(items, lambda index: None)
+
+    def show_line_timings(self):
+        """ Lists the output lines which took the longest to arrive after the previous one """
+        line_times = self.line_times
+        if not line_times or not hasattr(self, 'output_view'):
+            sublime.status_message("No line timestamps, enable the build_line_timestamps setting")
+            return
+
+        previous_times = array.array('d', [self.line_times_start])
+        previous_times.extend(line_times[:-1])
+
+        gaps = heapq.nlargest(
+            self.SLOWEST_LINES_COUNT,
+            range(len(line_times)),
+            key=lambda index: line_times[index] - previous_times[index])
+
+        output_view = self.output_view
+        items = []
+        for index in gaps:
+            text = output_view.substr(output_view.line(output_view.text_point(index, 0)))
+            items.append(["%.2fs  line %d" % (line_times[index] - previous_times[index], index + 1), text.strip()])
+
+        def show_line(selected):
+            if selected < 0:
+                return
+
+            point = output_view.text_point(gaps[selected], 0)
+            self.window.run_command("show_panel", {"panel": "output.exec"})
+            output_view.sel().clear()
+            output_view.sel().add(sublime.Region(point))
+            output_view.show_at_center(point)
+
+        self.window.show_quick_panel(items, show_line, on_highlight=show_line)
+
+    def update_phantoms(self, file_name=None):
+        """ Updates the phantoms of all files, or only of the given file name """
+        if file_name is None:
+            errs_by_file = self.errs_by_file.items()
+
+        else:
+            file = self.errs_files_by_path.get(normalize_path(file_name))
+            if file is None:
+                return
+            errs_by_file = [(file, self.errs_by_file[file])]
+
         stylesheet = '''
             <style>
                 div.error-arrow {
@@ -846,7 +1487,7 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
             </style>
         '''
 
-        for file, errs in self.errs_by_file.items():
+        for file, errs in errs_by_file:
             view = self.window.find_open_file(file)
             if view:
 
@@ -873,6 +1514,14 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
 
                 phantom_set.update(phantoms)
 
+    def clear_phantoms(self):
+        for phantom_set in self.phantom_sets_by_buffer.values():
+            phantom_set.update([])
+
+        self.errs_by_file = {}
+        self.errs_files_by_path = {}
+        g_windows_with_errors.discard(self.window.id())
+
     def hide_phantoms(self):
         for file, errs in self.errs_by_file.items():
             view = self.window.find_open_file(file)
@@ -880,8 +1529,10 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
                 view.erase_phantoms("exec")
 
         self.errs_by_file = {}
+        self.errs_files_by_path = {}
         self.phantom_sets_by_buffer = {}
         self.show_errors_inline = False
+        g_windows_with_errors.discard(self.window.id())
 
     def on_phantom_navigate(self, url):
         self.hide_phantoms()
@@ -889,6 +1540,241 @@ class ExecCommand(sublime_plugin.WindowCommand, ProcessListener):
 
 class ExecEventListener(sublime_plugin.EventListener):
     def on_load(self, view):
+        position = g_pending_navigations.pop(view.id(), None)
+        if position:
+            show_position(view, *position)
+
         w = view.window() or sublime.active_window()
-        if w is not None:
-            w.run_command('exec', {'update_phantoms_only': True})
+        file_name = view.file_name()
+
+        if w is not None and file_name and w.id() in g_windows_with_errors:
+            w.run_command('exec', {'update_phantoms_only': True, 'update_phantoms_file': file_name})
+
+    def on_close(self, view):
+        g_pending_navigations.pop(view.id(), None)
+
+    def on_post_save_async(self, view):
+        window = view.window()
+        if window is None or window.id() not in g_watch_patterns:
+            return
+
+        file_name = os.path.basename(view.file_name() or "")
+        patterns = g_watch_patterns[window.id()]
+        if not any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns):
+            return
+
+        # Debounce bursts of saves, as "Save All", into a single build
+        window_id = window.id()
+        generation = g_watch_generation.get(window_id, 0) + 1
+        g_watch_generation[window_id] = generation
+
+        save_time = time.time()
+        delay = view.settings().get('build_on_save_delay', 300)
+
+        def rerun():
+            if g_watch_generation.get(window_id) == generation:
+                window.run_command('exec', {'watch_rerun': save_time})
+
+        sublime.set_timeout(rerun, delay)
+
+
+class ExecClearOutputPanelCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        self.view.erase(edit, sublime.Region(0, self.view.size()))
+
+
+class ExecWatchCommand(sublime_plugin.WindowCommand):
+    """
+    Toggles the watch mode on this window, which runs the last build again
+    every time a file matching one of the `file_patterns` is saved.
+    """
+
+    def run(self, enable=None, file_patterns=None):
+        window_id = self.window.id()
+
+        if enable is None:
+            enable = window_id not in g_watch_patterns
+
+        if enable:
+            if file_patterns is None:
+                view = self.window.active_view()
+                file_patterns = view.settings().get('build_on_save_file_patterns', ["*"]) if view else ["*"]
+
+            g_watch_patterns[window_id] = file_patterns
+            sublime.status_message("Build on save enabled for %s" % ", ".join(file_patterns))
+
+        else:
+            g_watch_patterns.pop(window_id, None)
+            g_watch_generation.pop(window_id, None)
+            sublime.status_message("Build on save disabled")
+
+    def is_checked(self, **kwargs):
+        return self.window.id() in g_watch_patterns
+
+
+class FilterThroughCommandJob(ProcessListener):
+    """
+    Pipes a list of view regions through a command, one process per region,
+    collecting their outputs in memory until all of them have finished.
+    """
+
+    def __init__(self, view, regions, cmd, shell_cmd, env, encoding, **kwargs):
+        self.view = view
+        self.regions = regions
+        self.encoding = encoding
+        self.change_count = view.change_count()
+        self.cancelled = False
+
+        # The readers may deliver data before AsyncProcess returns the proc
+        self.outputs = collections.defaultdict(list)
+        self.errors = collections.defaultdict(list)
+        self.ended_streams = collections.defaultdict(set)
+        self.ended_lock = threading.Lock()
+        self.finished = 0
+        self.procs = []
+
+        for region in regions:
+            proc = AsyncProcess(cmd, shell_cmd, env, self, stdin_data=view.substr(region), **kwargs)
+            self.procs.append(proc)
+
+    def cancel(self):
+        self.cancelled = True
+
+        for proc in self.procs:
+            proc.kill()
+
+    def on_data(self, proc, data):
+        self.outputs[proc].append(data)
+
+    def on_error_data(self, proc, data):
+        self.errors[proc].append(data)
+
+    def on_finished(self, proc):
+        self.on_stream_ended(proc, "stdout")
+
+    def on_error_finished(self, proc):
+        self.on_stream_ended(proc, "stderr")
+
+    def on_stream_ended(self, proc, stream):
+        """
+        Finishes proc once both of its readers are done, counting each stream
+        once as a process killed on a limit also reports being finished
+        """
+        streams = 2 if proc.proc.stderr else 1
+        with self.ended_lock:
+            ended = self.ended_streams[proc]
+            if stream in ended:
+                return
+            ended.add(stream)
+            # A killed process reports no more than being finished
+            if len(ended) < streams and not proc.killed:
+                return
+
+        # Wait for the exit code to be available
+        proc.proc.wait()
+        sublime.set_timeout(functools.partial(self.finish, proc), 0)
+
+    def finish(self, proc):
+        self.finished += 1
+
+        if self.cancelled or self.finished < len(self.procs):
+            return
+
+        view_id = self.view.id()
+        if FilterThroughCommandCommand.jobs.get(view_id) is self:
+            del FilterThroughCommandCommand.jobs[view_id]
+
+        for proc in self.procs:
+            exit_code = proc.exit_code()
+
+            if exit_code:
+                error = "".join(self.errors[proc]).strip()
+                print("[filter_through_command] Exit code %d: %s" % (exit_code, error))
+                sublime.status_message("Filter failed with exit code %d, the text was not changed" % exit_code)
+                return
+
+        if self.view.change_count() != self.change_count:
+            sublime.status_message("The view was modified while filtering, the text was not changed")
+            return
+
+        FilterThroughCommandCommand.results[view_id] = self
+        self.view.run_command("filter_through_command_replace")
+        sublime.status_message("Filtered %d region%s" % (len(self.regions), "s" if len(self.regions) > 1 else ""))
+
+    def replacements(self):
+        for region, proc in zip(self.regions, self.procs):
+            # Normalize newlines, Sublime Text always uses a single \n separator
+            text = "".join(self.outputs[proc]).replace('\r\n', '\n').replace('\r', '\n')
+            yield region, text
+
+
+class FilterThroughCommandCommand(sublime_plugin.TextCommand):
+    """
+    Streams the non-empty selections, or the whole buffer when nothing is
+    selected, into the stdin of a command and replaces them with its output.
+
+    The buffer is only changed when every process finished successfully, in
+    a single edit, so cancelling with `"kill": true` keeps the original text.
+    """
+    jobs = {}
+    results = {}
+    last_shell_cmd = ""
+
+    def run(self, edit, cmd=None, shell_cmd=None, env={}, encoding="utf-8", kill=False, **kwargs):
+        view = self.view
+        job = self.jobs.pop(view.id(), None)
+
+        if job:
+            job.cancel()
+
+            if kill:
+                sublime.status_message("Filter cancelled")
+                return
+
+        elif kill:
+            return
+
+        if not cmd and not shell_cmd:
+            window = view.window() or sublime.active_window()
+
+            def on_done(shell_cmd):
+                FilterThroughCommandCommand.last_shell_cmd = shell_cmd
+                view.run_command("filter_through_command",
+                        dict(kwargs, shell_cmd=shell_cmd, env=env, encoding=encoding))
+
+            window.show_input_panel("Filter through command:", self.last_shell_cmd, on_done, None, None)
+            return
+
+        regions = [region for region in view.sel() if not region.empty()]
+        if not regions:
+            regions = [sublime.Region(0, view.size())]
+
+        # Change to the file directory, as `exec` does for the working dir
+        if view.file_name():
+            os.chdir(os.path.dirname(view.file_name()))
+
+        try:
+            self.jobs[view.id()] = FilterThroughCommandJob(
+                    view, regions, cmd, shell_cmd, env, encoding, **kwargs)
+            sublime.status_message("Filtering...")
+
+        except Exception as error:
+            print("[filter_through_command]", error)
+            sublime.status_message("Filter failed: %s" % error)
+
+    def is_enabled(self, kill=False, **kwargs):
+        if kill:
+            return self.view.id() in self.jobs
+        return True
+
+
+class FilterThroughCommandReplaceCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        job = FilterThroughCommandCommand.results.pop(self.view.id(), None)
+
+        if job:
+            # Replace from the end, so the earlier regions are not shifted
+            for region, text in reversed(list(job.replacements())):
+                self.view.replace(edit, region, text)
@@ -6,15 +6,58 @@ jump backwards and forwards
 
 import sublime
 import sublime_plugin
-import unittest
 import time
+import array
+import json
+import os
+
+from collections import OrderedDict
+
+class ViewPoints(object):
+  """
+  The selections stored for a single view, as a flat array of region points
+  and the ids of the entries stored on it, in the order they were added
+  """
+  __slots__ = ('points', 'entries', 'registered', 'change_count', 'erased')
+
+  def __init__(self):
+    self.points = array.array('q')
+    self.entries = array.array('q')
+
+    # The sorted points of each block registered with add_regions, when the
+    # view had change_count
+    self.registered = []
+    self.change_count = None
+    self.erased = 0
+
 
 # https://github.com/SublimeTextIssues/Core/issues/1846
 class RegionsManager(object):
+  """
+  Stores the selections of the history entries, as a flat array of points per
+  view, and the (offset, count) of each entry on it as columns indexed by the
+  entry id. The points of a view are registered as empty regions in blocks of
+  BLOCK_SIZE points, each under its own add_regions key, instead of one key per
+  entry, so Sublime Text moves them when the buffer is edited. Adding points
+  only registers the last block again. Edits never reorder the points, so
+  sorting the stored points of a block maps them to the regions Sublime Text
+  returns.
+  """
+  manager_count = 0
+  BLOCK_SIZE = 64
+
   def __init__(self):
     self.regions = {}
 
-  def add(self, view, region, contents):
+    # entry id to its offset and count on its view points, and its view id
+    self.offsets = array.array('q')
+    self.counts = array.array('q')
+    self.owners = array.array('q')
+
+    RegionsManager.manager_count += 1
+    self.regions_key = 'jump_history_points_%d' % RegionsManager.manager_count
+
+  def add(self, view, entry, contents):
     view_id = view.id()
     regions = self.regions
 
@@ -22,55 +65,288 @@ class RegionsManager(object):
         contents = [ s for s in contents ]
 
     if view_id not in regions:
-      regions[view_id] = {}
+      regions[view_id] = ViewPoints()
+
+    view_points = regions[view_id]
+    self.rebase(view, view_points)
+
+    missing = entry + 1 - len(self.offsets)
+    if missing > 0:
+      self.offsets.extend([0] * missing)
+      self.counts.extend([0] * missing)
+      self.owners.extend([-1] * missing)
 
     # print( 'Adding region', contents )
-    regions[view_id][region] = contents
+    points = view_points.points
+    first_block = len(points) // self.BLOCK_SIZE
+    self.offsets[entry] = len(points)
+    self.counts[entry] = len(contents) * 2
+    self.owners[entry] = view_id
+    view_points.entries.append(entry)
 
-  def get(self, view, region):
+    for selection in contents:
+      points.append(selection.a)
+      points.append(selection.b)
+
+    self.register(view, view_points, first_block)
+
+  def get(self, view, entry):
     view_id = view.id()
-    regions = self.regions
+    view_points = self.regions.get(view_id)
 
-    if view_id in regions:
-      if region in regions[view_id]:
-        # print( 'Getting region', regions[view_id][region] )
-        return regions[view_id][region]
+    if view_points and entry < len(self.owners) and self.owners[entry] == view_id:
+      self.rebase(view, view_points)
+
+      offset = self.offsets[entry]
+      points = view_points.points
+      # print( 'Getting region', points[offset:offset + self.counts[entry]] )
+      return [sublime.Region(points[index], points[index + 1]) for index in range(offset, offset + self.counts[entry], 2)]
 
     return []
 
-  def erase(self, view, region):
+  def erase(self, view, entry):
     view_id = view.id()
-    regions = self.regions
+    view_points = self.regions.get(view_id)
 
-    if view_id in regions:
-      if region in regions:
-        # print( 'Deleting region', regions[view_id][region] )
-        del regions[view_id][region]
+    if view_points and entry < len(self.owners) and self.owners[entry] == view_id:
+      # print( 'Deleting region', self.offsets[entry], self.counts[entry] )
+      view_points.erased += self.counts[entry]
+      self.counts[entry] = 0
+      self.owners[entry] = -1
+
+      if view_points.erased == len(view_points.points):
+        del self.regions[view_id]
+
+        for block in range(len(view_points.registered)):
+          view.erase_regions(self.block_key(block))
+
+      # Compact the points once most of them belong to erased entries
+      elif view_points.erased > len(view_points.points) // 2:
+        self.compact(view, view_points)
+
+  def compact(self, view, view_points):
+    self.rebase(view, view_points)
+
+    view_id = view.id()
+    old_points = view_points.points
+    points = array.array('q')
+    entries = array.array('q')
+    kept = set()
+
+    # The ids of erased entries may have been reused, by this or other views
+    for entry in view_points.entries:
+      if self.owners[entry] == view_id and self.counts[entry] and entry not in kept:
+        offset = self.offsets[entry]
+        self.offsets[entry] = len(points)
+        points.extend(old_points[offset:offset + self.counts[entry]])
+        entries.append(entry)
+        kept.add(entry)
+
+    view_points.points = points
+    view_points.entries = entries
+    view_points.erased = 0
+    self.register(view, view_points)
+
+  def block_key(self, block):
+    return '%s_%d' % (self.regions_key, block)
+
+  def register(self, view, view_points, first_block=0):
+    """ Registers the blocks of points from first_block on """
+    registered = view_points.registered
+    block_count = (len(view_points.points) + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+
+    for block in range(block_count, len(registered)):
+      view.erase_regions(self.block_key(block))
+    del registered[first_block:]
+
+    for block in range(first_block, block_count):
+      registered.append(None)
+      self.register_block(view, view_points, block)
+
+    view_points.change_count = view.change_count()
+
+  def register_block(self, view, view_points, block):
+    start = block * self.BLOCK_SIZE
+    block_points = array.array('q', sorted(set(view_points.points[start:start + self.BLOCK_SIZE])))
+    view_points.registered[block] = block_points
+
+    view.add_regions(
+        self.block_key(block),
+        [sublime.Region(point) for point in block_points],
+        "", "", sublime.HIDDEN)
+
+  def rebase(self, view, view_points):
+    """ Moves the stored points by the edits done since they were registered """
+    change_count = view.change_count()
+    if change_count == view_points.change_count:
+      return
+
+    points = view_points.points
+
+    for block, registered in enumerate(view_points.registered):
+      moved = view.get_regions(self.block_key(block))
+
+      if len(moved) == len(registered):
+        start = block * self.BLOCK_SIZE
+        moved_points = dict(zip(registered, (region.a for region in moved)))
+        points[start:start + self.BLOCK_SIZE] = array.array(
+            'q', (moved_points[point] for point in points[start:start + self.BLOCK_SIZE]))
+        view_points.registered[block] = array.array('q', (region.a for region in moved))
+
+      else:
+        # Some points were merged, keep the old positions from now on
+        self.register_block(view, view_points, block)
+
+    view_points.change_count = change_count
+
+
+class JumpEntries(object):
+    """
+    Stores the entries of all jump histories once, as parallel columns indexed
+    by an integer id: the view, the viewport, the line preview and how many
+    histories reference it. The window and view histories only hold the ids,
+    and pushing the same selection into both shares a single entry.
+    """
+
+    def __init__(self):
+        self.views = []
+        self.previews = []
+        self.viewports = array.array('d')
+        self.references = array.array('q')
+        self.regions = RegionsManager()
+
+        # ids of the released entries, reused by the next ones
+        self.free = array.array('q')
+
+        # the newest entry and the change count of its view when added
+        self.newest = -1
+        self.newest_change_count = None
+
+    def add(self, view, region_list, viewport, preview):
+        """ Returns the id of a new entry, or of the newest one if it is the same """
+        newest = self.newest
+        change_count = view.change_count()
+
+        if newest >= 0 and self.references[newest] \
+                and self.views[newest].id() == view.id() \
+                and self.newest_change_count == change_count \
+                and self.previews[newest] == preview \
+                and self.viewport(newest) == tuple(viewport) \
+                and self.regions.get(view, newest) == list(region_list):
+            self.references[newest] += 1
+            return newest
+
+        if self.free:
+            entry = self.free.pop()
+            self.views[entry] = view
+            self.previews[entry] = preview
+            self.viewports[entry * 2:entry * 2 + 2] = array.array('d', viewport)
+            self.references[entry] = 1
+
+        else:
+            entry = len(self.views)
+            self.views.append(view)
+            self.previews.append(preview)
+            self.viewports.extend(viewport)
+            self.references.append(1)
+
+        self.regions.add(view, entry, region_list)
+        self.newest = entry
+        self.newest_change_count = change_count
+        return entry
+
+    def release(self, entry):
+        self.references[entry] -= 1
+
+        if not self.references[entry]:
+            self.regions.erase(self.views[entry], entry)
+            self.views[entry] = None
+            self.previews[entry] = None
+            self.free.append(entry)
+
+    def view(self, entry):
+        return self.views[entry]
+
+    def viewport(self, entry):
+        return (self.viewports[entry * 2], self.viewports[entry * 2 + 1])
+
+    def preview(self, entry):
+        return self.previews[entry]
+
+    def selection(self, entry):
+        view = self.views[entry]
+        return self.regions.get(view, entry) if view else []
+
+
+# the entries shared by all jump histories
+jump_entries = JumpEntries()
 
 
 class JumpHistory():
     """
     Stores the current jump history
+
+    The entry ids are kept on a ring buffer of up to LIST_LIMIT slots, indexed
+    by an ever increasing sequence number, and a per-view index of the sequence
+    numbers of each view entries. Removing the entries of a view leaves empty
+    slots behind, which are skipped while jumping, so pushing, trimming and
+    removing a view are all O(1) amortized.
     """
 
     LIST_LIMIT = 1200
-    LIST_TRIMMED_SIZE = 1000
+    EMPTY = -1
 
     def __init__(self):
-        self.history_list = []
-        self.all_regions = RegionsManager()
+        # grown up to LIST_LIMIT slots, as most view histories stay small
+        self.slots = array.array('q', [self.EMPTY] * 16)
+
+        # start is the sequence number of the oldest slot and end is one past
+        # the newest one. Both ends always hold an entry, unless it is empty.
+        self.start = 0
+        self.end = 0
+        self.count = 0
+        self.view_entries = {}
+
+        # current points to the sequence number of the entry we jumped to, or is
+        # None when pointing to the imaginary head after the newest entry, i.e.,
+        # the current caret position not yet pushed
+        self.current = None
+
+        # The ("windows", project) or ("views", file name) this history is saved with
+        self.storage_key = None
 
-        # current_item point to newest item of the queue, which is at the back of the
-        # list. To make appending easier current_item is a negative index
-        # current_item would be -1 to point to the newest item and -len to point to oldest
-        self.current_item = 0
-        self.key_counter = 0
+        # The saved [file name, points, viewport, preview] entries of files
+        # not open when restored, written back with the restored ones
+        self.unrestored = []
 
-    def push_selection(self, view):
+    def __del__(self):
+        # release the shared entries of the histories dropped without delete_view
+        if jump_entries is not None:
+            self.release_entries()
+
+    def slot(self, sequence):
+        return self.slots[sequence % len(self.slots)]
+
+    def set_slot(self, sequence, entry):
+        self.slots[sequence % len(self.slots)] = entry
+
+    def grow(self):
+        capacity = min(len(self.slots) * 2, self.LIST_LIMIT)
+        slots = array.array('q', [self.EMPTY]) * capacity
+
+        for sequence in range(self.start, self.end):
+            slots[sequence % capacity] = self.slot(sequence)
+
+        self.slots = slots
+
+    def push_selection(self, view, min_lines=0):
         """
         Push the current selection of the view into this history.
         If we push a selection into history while current item is not pointing
         to head, anything before the current item is erased
+
+        A selection less than min_lines away from the newest entry on the same
+        view does not create a new entry.
         """
         region_list = list(view.sel())
 
@@ -82,135 +358,403 @@ class JumpHistory():
         self.clear_history_after_current()
 
         # check the newest entry is not the same as selection
-        if self.history_list != []:
-            first_view, first_key, viewport = self.history_list[-1]
-            if first_view.view_id == view.view_id:
-                first_sel = self.all_regions.get(view, first_key)
+        if self.count:
+            first_entry = self.slot(self.end - 1)
+            if jump_entries.view(first_entry).view_id == view.view_id:
+                first_sel = jump_entries.selection(first_entry)
                 # print( 'first_sel', first_sel )
                 if first_sel == region_list:
                     # print( 'Same as newest selection entry' )
                     return
 
-        key = self.generate_key()
-        self.all_regions.add(view, key, region_list)
+                if min_lines and first_sel:
+                    first_row = view.rowcol(first_sel[0].b)[0]
+                    if abs(view.rowcol(region_list[0].b)[0] - first_row) < min_lines:
+                        return
+
+        self.append_entry(view, region_list, view.viewport_position())
+
+        if self.storage_key:
+            JumpHistoryStorage.schedule_save()
+
+    def append_entry(self, view, region_list, viewport, preview=None):
+        if preview is None:
+            preview = self.line_preview(view, region_list)
+
+        if self.end - self.start == len(self.slots):
+            if len(self.slots) < self.LIST_LIMIT:
+                self.grow()
+            else:
+                self.trim_selections()
 
-        # print( 'set the new selection as the current item, as a tuple (view_id, key)' )
-        self.history_list.append((view, key, view.viewport_position()))
-        self.trim_selections()
+        # print( 'set the new selection as the current item' )
+        self.set_slot(self.end, jump_entries.add(view, region_list, viewport, preview))
+        self.view_entries.setdefault(view.view_id, set()).add(self.end)
+        self.end += 1
+        self.count += 1
 
     def jump_back(self, active_view):
         """
         Return the view and selection list to jump back to
-        Jump back in history. If the current_item is -1, it also pushes the
+        Jump back in history. When pointing to the head, it also pushes the
         active view sel() into the history.
         """
-        if self.current_item == 0:
+        if self.current is None:
             # print( 'we got no head, add one so we can jump back there' )
             # note that the push might not add anything if the region
             # is empty or if the region is the same as the previous
-            # one, but we still increment current item. This is such
+            # one, but we still point to the newest item. This is such
             # that the newest item is always the newest location
             self.push_selection(active_view)
-            self.current_item = -1
 
-        if self.current_item == -len(self.history_list):
+            if not self.count:
+                return None, [], None
+            self.current = self.end - 1
+
+        previous = self.current - 1
+        while previous >= self.start and self.slot(previous) == self.EMPTY:
+            previous -= 1
+
+        if previous < self.start:
             # print( 'already pointing to the oldest' )
             return None, [], None
 
-        self.current_item -= 1
-        # print( 'get the next (older) selection, current_item', self.current_item )
-        view, key, viewport = self.history_list[self.current_item]
-        return view, self.all_regions.get(view, key), viewport
+        self.current = previous
+        # print( 'get the next (older) selection, current', self.current )
+        return self.entry_location(self.slot(self.current))
+
+    def jump_to(self, sequence, active_view):
+        """ Jumps directly to the entry with the given sequence number """
+        if self.current is None:
+            # add the head, so we can jump forward back to it
+            self.push_selection(active_view)
+
+        if sequence < self.start or sequence >= self.end or self.slot(sequence) == self.EMPTY:
+            return None, [], None
+
+        self.current = sequence
+        return self.entry_location(self.slot(sequence))
+
+    def entries(self):
+        """ Returns the (sequence, entry id) of the entries, newest first """
+        for sequence in range(self.end - 1, self.start - 1, -1):
+            entry = self.slot(sequence)
+
+            if entry != self.EMPTY:
+                yield sequence, entry
+
+    @staticmethod
+    def entry_location(entry):
+        """ Returns the view, selection and viewport of the entry """
+        return jump_entries.view(entry), jump_entries.selection(entry), jump_entries.viewport(entry)
+
+    @staticmethod
+    def line_preview(view, region_list):
+        if not region_list:
+            return ""
+
+        line = view.line(region_list[0].b)
+        return view.substr(sublime.Region(line.a, min(line.b, line.a + 200))).strip()
 
     def jump_forward(self, active_view):
-        if self.history_list == []:
+        if not self.count:
             return None, [], None
 
-        if self.current_item >= -1:
+        if self.current is None or self.current == self.end - 1:
             # print( 'already pointing to the front' )
             return None, [], None
 
-        self.current_item += 1
-        # print( 'get the top selection, current_item', self.current_item )
-        view, key, viewport = self.history_list[self.current_item]
-        return view, self.all_regions.get(view, key), viewport
+        following = self.current + 1
+        while self.slot(following) == self.EMPTY:
+            following += 1
+
+        self.current = following
+        # print( 'get the top selection, current', self.current )
+        return self.entry_location(self.slot(self.current))
 
     def remove_view(self, view_id):
-        i = 0
-        # use negative indices since current_item is negative
-        # remove any selection that has the same view id
-        # adjust the current_item, iterate from the back
-        while (i > -len(self.history_list)):
-            i -= 1
-            if self.history_list[i][0].view_id == view_id:
-                del self.history_list[i]
-                if self.current_item <= i:
-                    self.current_item += 1
+        # remove any selection that has the same view id, moving the current
+        # item to the next newer entry when it pointed to a removed one
+        for sequence in self.view_entries.pop(view_id, ()):
+            jump_entries.release(self.slot(sequence))
+            self.set_slot(sequence, self.EMPTY)
+            self.count -= 1
+
+        self.trim_empty_slots()
+
+        if self.current is not None:
+            while self.current < self.end and self.slot(self.current) == self.EMPTY:
+                self.current += 1
+
+            if self.current >= self.end:
+                self.current = None
 
     def delete_view(self, view_id):
+        if self.storage_key:
+            JumpHistoryStorage.store(self)
+
         if view_id in jump_view_history_dict:
             del jump_view_history_dict[view_id]
 
-        if view_id in self.all_regions.regions:
-            del self.all_regions.regions[view_id]
+        self.release_entries()
+
+    def release_entries(self):
+        for sequence in range(self.start, self.end):
+            entry = self.slot(sequence)
+
+            if entry != self.EMPTY:
+                jump_entries.release(entry)
+                self.set_slot(sequence, self.EMPTY)
+
+        self.start = self.end
+        self.count = 0
+        self.current = None
+        self.view_entries = {}
 
-    def generate_key(self):
-        # generate enough keys for 5 times the jump history limit
-        # this can still cause clashes as new history can be erased when we jump
-        # back several steps and jump again.
-        self.key_counter += 1
-        self.key_counter %= self.LIST_LIMIT * 5
-        return 'jump_key_' + hex(self.key_counter)
+    def pop_slot(self, sequence):
+        entry = self.slot(sequence)
+
+        if entry != self.EMPTY:
+            view_id = jump_entries.view(entry).view_id
+            jump_entries.release(entry)
+            view_entries = self.view_entries[view_id]
+            view_entries.discard(sequence)
+
+            if not view_entries:
+                del self.view_entries[view_id]
+            self.set_slot(sequence, self.EMPTY)
+            self.count -= 1
 
     def clear_history_after_current(self):
-        # print( 'clear_history_after_current, current_item', self.current_item )
-        if self.current_item == 0:
+        # print( 'clear_history_after_current, current', self.current )
+        if self.current is None:
             return
 
         # remove all history that are newer than current
-        for i in range(-1, self.current_item):
-            view, key, viewport = self.history_list[i]
-            self.all_regions.erase(view, key)
+        while self.end - 1 > self.current:
+            self.end -= 1
+            self.pop_slot(self.end)
 
-        if self.current_item < -1:
-            del self.history_list[self.current_item + 1:]
-        # set current_item to the imaginary back (current caret position not yet pushed)
-        self.current_item = 0
+        # set current to the imaginary back (current caret position not yet pushed)
+        self.current = None
 
     def trim_selections(self):
-        # print( 'history_list', self.history_list )
-        if len(self.history_list) > self.LIST_LIMIT:
-            # max reached, remove everything too old
-            # trim to a smaller size to avoid doing on this every insert
-            for i in range(0, len(self.history_list) - self.LIST_TRIMMED_SIZE):
-                # erase the regions from view
-                view, key, viewport = self.history_list[i]
-                self.all_regions.erase(view, key)
-            del self.history_list[: len(self.history_list) - self.LIST_TRIMMED_SIZE]
+        # max reached, remove the oldest slot to make room for a new one
+        self.pop_slot(self.start)
+        self.start += 1
+        self.trim_empty_slots()
+
+    def trim_empty_slots(self):
+        while self.start < self.end and self.slot(self.start) == self.EMPTY:
+            self.start += 1
+
+        while self.end > self.start and self.slot(self.end - 1) == self.EMPTY:
+            self.end -= 1
 
     def len(self):
-        return len(self.history_list)
+        return self.count
+
+    def serialize(self):
+        """
+        Returns the entries as a list of file names and a list of entries
+        [file index, flat selection points, viewport], skipping unsaved views
+        """
+        file_names = []
+        file_indexes = {}
+        entries = []
+
+        def file_index(file_name):
+            if file_name not in file_indexes:
+                file_indexes[file_name] = len(file_names)
+                file_names.append(file_name)
+            return file_indexes[file_name]
+
+        # The entries of files not open are older than the restored ones
+        for file_name, points, viewport, preview in self.unrestored[max(0, len(self.unrestored) + self.count - self.LIST_LIMIT):]:
+            entries.append([file_index(file_name), points, viewport, preview])
+
+        for sequence in range(self.start, self.end):
+            entry = self.slot(sequence)
+            if entry == self.EMPTY:
+                continue
+
+            view = jump_entries.view(entry)
+            file_name = view.file_name()
+            if not file_name:
+                continue
+
+            points = []
+            for region in jump_entries.selection(entry):
+                points.extend((region.a, region.b))
+
+            entries.append([file_index(file_name), points, list(jump_entries.viewport(entry)), jump_entries.preview(entry)])
+
+        return [file_names, entries]
+
+    def restore(self, serialized, find_view):
+        """
+        Restores the serialized entries whose file has a view on find_view, and
+        keeps the others to save them again
+        """
+        file_names, entries = serialized
+        views = [find_view(file_name) for file_name in file_names]
+        view_size = [view.size() if view else 0 for view in views]
+
+        for entry in entries:
+            file_index, points, viewport = entry[:3]
+            preview = entry[3] if len(entry) > 3 else None
+
+            view = views[file_index]
+            if not view:
+                self.unrestored.append([file_names[file_index], points, viewport, preview])
+                continue
+
+            # Skip positions past the end of files which shrunk since saved
+            size = view_size[file_index]
+            if any(point > size for point in points):
+                continue
+
+            region_list = [sublime.Region(points[index], points[index + 1]) for index in range(0, len(points), 2)]
+            self.append_entry(view, region_list, tuple(viewport), preview)
+
+
+class JumpHistoryStorage(object):
+    """
+    Saves the window jump histories keyed by their project, and the view jump
+    histories keyed by their file name, to a file on the cache path.
+    """
+    SAVE_DELAY = 5000
+    MAX_WINDOWS = 50
+    MAX_FILES = 500
+
+    data = None
+    save_scheduled = False
+
+    @classmethod
+    def file_path(cls):
+        return os.path.join(sublime.cache_path(), "jump_history.json")
+
+    @classmethod
+    def load(cls):
+        if cls.data is None:
+            cls.data = {"windows": OrderedDict(), "views": OrderedDict()}
+
+            try:
+                with open(cls.file_path(), 'r', encoding='utf-8') as history_file:
+                    cls.data.update(json.load(history_file, object_pairs_hook=OrderedDict))
+            except (OSError, ValueError) as error:
+                if os.path.exists(cls.file_path()):
+                    print("[history_list] Could not load the jump history:", error)
+
+        return cls.data
+
+    @staticmethod
+    def window_key(window):
+        folders = window.folders()
+        return window.project_file_name() or (folders[0] if folders else "")
+
+    @classmethod
+    def restore_window(cls, window):
+        history = JumpHistory()
+        history.storage_key = ("windows", cls.window_key(window))
+
+        serialized = cls.load()["windows"].get(history.storage_key[1])
+        if serialized:
+            history.restore(serialized, window.find_open_file)
+
+        return history
+
+    @classmethod
+    def restore_view(cls, view):
+        history = JumpHistory()
+        file_name = view.file_name()
+
+        if file_name:
+            history.storage_key = ("views", file_name)
+            serialized = cls.load()["views"].get(file_name)
+
+            if serialized:
+                history.restore(serialized, lambda file_name: view)
+
+        return history
+
+    @classmethod
+    def schedule_save(cls):
+        if not cls.save_scheduled:
+            cls.save_scheduled = True
+            sublime.set_timeout(cls.save, cls.SAVE_DELAY)
+
+    @classmethod
+    def store(cls, history):
+        kind, key = history.storage_key
+        saved = cls.load()[kind]
+
+        # Move the key to the end, so the least recently used are trimmed
+        saved.pop(key, None)
+        saved[key] = history.serialize()
+
+    @classmethod
+    def snapshot(cls):
+        """ Copies the histories into the saved data, on the main thread """
+        data = cls.load()
+
+        for history in list(jump_history_dict.values()) + list(jump_view_history_dict.values()):
+            if history.storage_key:
+                cls.store(history)
+
+        for kind, limit in (("windows", cls.MAX_WINDOWS), ("views", cls.MAX_FILES)):
+            saved = data[kind]
+
+            while len(saved) > limit:
+                saved.popitem(last=False)
+
+        return {"windows": OrderedDict(data["windows"]), "views": OrderedDict(data["views"])}
+
+    @classmethod
+    def save(cls):
+        cls.save_scheduled = False
+        data = cls.snapshot()
+        sublime.set_timeout_async(lambda: cls.write(data), 0)
+
+    @classmethod
+    def write(cls, data):
+        temporary_path = cls.file_path() + ".tmp"
+
+        with open(temporary_path, 'w', newline='\n', encoding='utf-8') as history_file:
+            json.dump(data, history_file, separators=(',', ':'))
+        os.replace(temporary_path, cls.file_path())
 
 
 # dict from window id to JumpHistory
 jump_history_dict = {}
 jump_view_history_dict = {}
 
-def get_jump_history(window_id, view_id=None):
+def get_jump_history_for_view(view, view_id=None):
+    """ Returns the window or view history, restoring the saved one on first use """
     if view_id is not None:
-        return jump_view_history_dict.setdefault(view_id, JumpHistory())
-    else:
-        return jump_history_dict.setdefault(window_id, JumpHistory())
+        if view_id not in jump_view_history_dict:
+            if view.is_loading():
+                # Its saved positions can only be checked after loading it
+                return JumpHistory()
+            jump_view_history_dict[view_id] = JumpHistoryStorage.restore_view(view)
+        return jump_view_history_dict[view_id]
 
-def get_jump_history_for_view(view, view_id=None):
     win = view.window()
     if not win:
-        if view_id is None:
+        return JumpHistory()
+
+    if win.id() not in jump_history_dict:
+        if any(window_view.is_loading() for window_view in win.views()):
+            # Its saved positions can only be checked after loading its views
             return JumpHistory()
-        else:
-            return get_jump_history(None, view_id)
-    else:
-        return get_jump_history(win.id(), view_id)
+        jump_history_dict[win.id()] = JumpHistoryStorage.restore_window(win)
+    return jump_history_dict[win.id()]
+
+
+def plugin_unloaded():
+    # Save synchronously, as the plugin is about to be reloaded or the editor closed
+    if JumpHistoryStorage.data is not None:
+        JumpHistoryStorage.write(JumpHistoryStorage.snapshot())
 
 
 # remember that we are jumping and ignore
@@ -237,23 +781,42 @@ class JumpHistoryUpdater(sublime_plugin.EventListener):
     """
     lasttime = time.time()
 
-    def on_selection_modified(self, view):
+    # view id to the counter of its selection changes, to debounce them
+    pending_selections = {}
 
-        if view.settings().get('is_widget') or g_is_jumping:
+    def on_selection_modified_async(self, view):
+        # Ignore the selection changes done by jumping
+        if g_is_jumping or time.time() - JumpHistoryUpdater.lasttime < 1.5:
             return
 
-        timenow = time.time()
-        if timenow - JumpHistoryUpdater.lasttime < 1.5:
+        settings = view.settings()
+        if settings.get('is_widget'):
             return
 
-        # print( 'on_selection_modified' )
-        JumpHistoryUpdater.lasttime = timenow
+        view_id = view.id()
+        generation = self.pending_selections.get(view_id, 0) + 1
+        self.pending_selections[view_id] = generation
+
+        def record_settled_selection():
+            if self.pending_selections.get(view_id) == generation:
+                del self.pending_selections[view_id]
+                sublime.set_timeout(lambda: self.record_selection(view_id, min_lines), 0)
+
+        min_lines = settings.get('jump_history_min_lines', 5)
+        sublime.set_timeout_async(record_settled_selection, settings.get('jump_history_record_delay', 1000))
+
+    def record_selection(self, view_id, min_lines):
+        if g_is_jumping:
+            return
 
         # https://github.com/SublimeTextIssues/Core/issues/289
         view = sublime.active_window().active_view()
+        if not view or view.id() != view_id:
+            return
 
-        get_jump_history_for_view(view).push_selection(view)
-        get_jump_history_for_view(view, view.id()).push_selection(view)
+        # print( 'record_selection' )
+        get_jump_history_for_view(view).push_selection(view, min_lines)
+        get_jump_history_for_view(view, view.id()).push_selection(view, min_lines)
 
     def on_activated(self, view):
         self.on_deactivated( view )
@@ -277,7 +840,10 @@ class JumpHistoryUpdater(sublime_plugin.EventListener):
         # view on_deactivated
         view.settings().set('history_list_is_closing', True)
         get_jump_history_for_view(view).remove_view(view.id())
-        get_jump_history_for_view(view, view.id()).delete_view(view.id())
+
+        view_history = jump_view_history_dict.get(view.id())
+        if view_history:
+            view_history.delete_view(view.id())
         unlock_jump_history()
 
 
@@ -359,154 +925,77 @@ class JumpForwardCommand(sublime_plugin.TextCommand):
         unlock_jump_history()
 
 
-# unit testing
-# to run it in sublime text:
-# import Default.history_list
-# Default.history_list.Unittest.run()
-
-class Unittest(unittest.TestCase):
-
-    class Sublime:
-        pass
-
-    class View:
-        def __init__(self, id):
-            self.view_id = id
-            # just make it a list of regions
-            self.region_list = [sublime.Region(0, 0)]
-            self.key_to_region = {}
-
-        def sel(self):
-            return self.region_list
-
-        def set_sel(self, region):
-            self.region_list = [region]
-
-        def add_regions(self, key, regions):
-            self.key_to_region[key] = regions
-
-        def get_regions(self, key):
-            return self.key_to_region.get(key, [])
-
-        def erase_regions(self, key):
-            del self.key_to_region[key]
-
-    def run():
-        # redefine the modules to use the mock version
-        global sublime
-
-        sublime_module = sublime
-        # use the normal region
-        Unittest.Sublime.Region = sublime.Region
-        sublime = Unittest.Sublime
-
-        test = Unittest()
-        test.test_simple_jump()
-        test.test_duplicate_jump_history()
-        test.test_jump_branch()
-
-        # set it back after testing
-        sublime = sublime_module
-
-    def test_simple_jump(self):
-        history = JumpHistory()
-        view = Unittest.View(1)
-
-        # create a new selection
-        first_pos = sublime.Region(10, 10)
-        view.set_sel(first_pos)
-
-        # push
-        history.push_selection(view)
-
-        # go some where
-        second_pos = sublime.Region(20, 10)
-        view.set_sel(second_pos)
-
-        # now try to jump back
-        # should jump back to first pos
-        self.assertEqual(history.jump_back(view)[1][0], first_pos)
-
-        # now jump back again, should go no where
-        self.assertEqual(history.jump_back(view)[1], [])
-
-        # jump forward, should jump to where we were, this also test
-        # that second_pos is automatically pushed when we jump back
-        # from a new position
-        self.assertEqual(history.jump_forward(view)[1][0], second_pos)
-
-    # try to jump back two step and set new history
-    def test_jump_branch(self):
-        history = JumpHistory()
-        view = Unittest.View(1)
-
-        # create 3 jump positions
-        pos_1 = sublime.Region(1, 1)
-        view.set_sel(pos_1)
-        history.push_selection(view)
-
-        pos_2 = sublime.Region(2, 2)
-        view.set_sel(pos_2)
-        history.push_selection(view)
-
-        pos_3 = sublime.Region(3, 3)
-        view.set_sel(pos_3)
-        history.push_selection(view)
+class ShowJumpHistoryCommand(sublime_plugin.TextCommand):
+    """
+    Defines a new text command "show_jump_history", listing the jump history
+    on a quick panel, newest first. Highlighting an entry shows it without
+    changing the selection, and selecting it jumps directly to it.
+    """
 
-        pos_4 = sublime.Region(4, 4)
-        view.set_sel(pos_4)
+    def run(self, edit, this_view_only=False):
+        if self.view.settings().get('is_widget'):
+            self.view = sublime.active_window().active_view()
 
-        # now jump back to pos_2, and do few moves
-        self.assertEqual(history.jump_back(view)[1][0], pos_3)
-        self.assertEqual(history.jump_back(view)[1][0], pos_2)
+        active_view = self.view
+        window = active_view.window()
 
-        pos_3 = sublime.Region(3, 1)
-        view.set_sel(pos_3)
-        history.push_selection(view)
+        if this_view_only:
+            jump_history = get_jump_history_for_view(active_view, active_view.id())
+        else:
+            jump_history = get_jump_history_for_view(active_view)
 
-        pos_4 = sublime.Region(4, 1)
-        view.set_sel(pos_4)
-        history.push_selection(view)
+        entries = list(jump_history.entries())
+        if not entries:
+            sublime.status_message("The jump history is empty")
+            return
 
-        # now if I do a jump back i should get to pos_3
-        self.assertEqual(history.jump_back(view)[1][0], pos_3)
+        items = []
+        selected_index = 0
 
-        # back two more step should get to pos_1, show that history
-        # before pos_2 is still there
-        self.assertEqual(history.jump_back(view)[1][0], pos_2)
-        self.assertEqual(history.jump_back(view)[1][0], pos_1)
+        for index, (sequence, entry) in enumerate(entries):
+            view, region_list, viewport = jump_history.entry_location(entry)
+            row = view.rowcol(region_list[0].b)[0] + 1 if region_list else 0
+            name = os.path.basename(view.file_name() or view.name() or "untitled")
 
-        # test jumping forward again
-        self.assertEqual(history.jump_forward(view)[1][0], pos_2)
-        self.assertEqual(history.jump_forward(view)[1][0], pos_3)
+            items.append(["%s:%d" % (name, row), jump_entries.preview(entry)])
+            if sequence == jump_history.current:
+                selected_index = index
 
-    # test case where some jump history points are dups
-    def test_duplicate_jump_history(self):
-        history = JumpHistory()
-        view = Unittest.View(1)
+        # the viewport of each previewed view before its first preview
+        original_viewports = {active_view.id(): (active_view, active_view.viewport_position())}
 
-        # create a new selection
-        first_pos = sublime.Region(10, 10)
-        view.set_sel(first_pos)
+        def on_highlight(index):
+            sequence, entry = entries[index]
+            view = jump_entries.view(entry)
+            if view.id() not in original_viewports:
+                original_viewports[view.id()] = (view, view.viewport_position())
 
-        history.push_selection(view)
-        history.push_selection(view)
+            window.focus_view(view)
+            view.set_viewport_position(jump_entries.viewport(entry), False)
 
-        # go some where
-        second_pos = sublime.Region(20, 10)
-        view.set_sel(second_pos)
-        history.push_selection(view)
-        history.push_selection(view)
+        def restore_viewports():
+            for view, viewport in original_viewports.values():
+                view.set_viewport_position(viewport, False)
 
-        # now jump back, should jump back to first pos
-        # and ignore the previous two pushes
-        self.assertEqual(history.jump_back(view)[1][0], first_pos)
+        def on_select(index):
+            restore_viewports()
 
-        # now jump back again, should go no where
-        self.assertEqual(history.jump_back(view)[1], [])
+            if index < 0:
+                window.focus_view(active_view)
+                unlock_jump_history()
+                return
 
-        # jump forward would still jump to second_pos
-        self.assertEqual(history.jump_forward(view)[1][0], second_pos)
+            view, region_list, viewport = jump_history.jump_to(entries[index][0], active_view)
+            if region_list:
+                window.focus_view(view)
+                view.sel().clear()
+                view.sel().add_all(region_list)
+                view.set_viewport_position(viewport, True)
+            unlock_jump_history()
 
-        # jump forward again would go no where
-        self.assertEqual(history.jump_forward(view)[1], [])
+        # do not record the views focused while previewing the entries
+        lock_jump_history()
+        # previewing entries of other views focuses them, keep the panel open then
+        window.show_quick_panel(
+            items, on_select, flags=sublime.KEEP_OPEN_ON_FOCUS_LOST,
+            selected_index=selected_index, on_highlight=on_highlight)
@@ -3,6 +3,8 @@ import webbrowser
 
 import sublime_plugin
 
+from .context_event import ContextEventCache
+
 
 rex = re.compile(
     r'''(?x)
@@ -18,12 +20,16 @@ rex = re.compile(
 class OpenContextUrlCommand(sublime_plugin.TextCommand):
     def run(self, edit, event):
         url = self.find_url(event)
+        ContextEventCache.clear()
         webbrowser.open_new_tab(url)
 
     def is_visible(self, event):
         return self.find_url(event) is not None
 
     def find_url(self, event):
+        return ContextEventCache.get(self.view, event, "url", lambda: self.url_at_event(event))
+
+    def url_at_event(self, event):
         pt = self.view.window_to_text((event["x"], event["y"]))
         line = self.view.line(pt)
 
@@ -1,75 +1,418 @@
 import sublime
 import sublime_plugin
+import bisect
+import fnmatch
+import html
+import os
+import re
+import threading
+import time
 
+from collections import OrderedDict
 
-def lookup_symbol(window, symbol):
-    if len(symbol.strip()) < 3:
-        return []
+from .context_event import ContextEventCache
+
+try:
+    import sqlite3
+
+except ImportError:
+    # Not bundled with the Python of every Sublime Text build
+    sqlite3 = None
+
+
+class SymbolCache(object):
+    """
+    The merged locations of the symbols looked up on a window, least recently
+    used first, and the symbols found on each file, to forget the results of
+    the files being edited. The symbols found nowhere are kept apart, as any
+    edit may define them.
+    """
+
+    MAX_SYMBOLS = 500
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.files = {}
+        self.empty = set()
 
-    index_locations = window.lookup_symbol_in_index(symbol)
-    open_file_locations = window.lookup_symbol_in_open_files(symbol)
+    def get(self, key):
+        with self.lock:
+            locations = self.results.get(key)
+            if locations is not None:
+                self.results.move_to_end(key)
+            return locations
+
+    def contains(self, key):
+        """ Returns whether the key is cached, without marking it as used """
+        with self.lock:
+            return key in self.results
+
+    def put(self, key, locations):
+        with self.lock:
+            self.discard(key)
+            self.results[key] = locations
+
+            if not locations:
+                self.empty.add(key)
+
+            for l in locations:
+                self.files.setdefault(l[0], set()).add(key)
+
+            while len(self.results) > self.MAX_SYMBOLS:
+                self.discard(next(iter(self.results)))
+
+    def discard(self, key):
+        locations = self.results.pop(key, ())
+        self.empty.discard(key)
 
-    def file_in_location_list(fname, locations):
         for l in locations:
-            if l[0] == fname:
-                return True
-        return False
+            keys = self.files.get(l[0])
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.files[l[0]]
+
+    def invalidate_empty(self):
+        """ Forgets the symbols found nowhere """
+        with self.lock:
+            for key in list(self.empty):
+                self.discard(key)
+
+    def invalidate_untitled(self):
+        """ Forgets the symbols found on unsaved views, "<untitled N>" on the open files """
+        with self.lock:
+            for path in [path for path in self.files if path.startswith('<untitled ')]:
+                for key in list(self.files.get(path, ())):
+                    self.discard(key)
+
+    def invalidate(self, path, symbols=()):
+        """
+        Forgets the symbols found on path, and the given symbols, which may
+        have been added to it
+        """
+        with self.lock:
+            for key in list(self.files.get(path, ())):
+                self.discard(key)
+
+            for symbol in symbols:
+                for kind in ("definitions", "references"):
+                    self.discard((kind, symbol))
+
+
+# window id to its SymbolCache
+symbol_caches = {}
+
+
+class FallbackSymbolIndex(object):
+    """
+    An index of the definitions in the project folders, looked up when Sublime
+    Text finds none, e.g., with index_files disabled or on excluded folders.
+    The folders are scanned on a background thread with a regex per language,
+    and the definitions kept on an SQLite database on the cache path, only
+    rescanning the files whose mtime changed.
+    """
+
+    PATTERNS = [
+        (('.py', '.pyw'), [
+            r'^[ \t]*(?:async[ \t]+)?def[ \t]+(\w+)',
+            r'^[ \t]*class[ \t]+(\w+)']),
+        (('.js', '.jsx', '.mjs', '.ts', '.tsx'), [
+            r'\bfunction\*?[ \t]+([\w$]+)',
+            r'^[ \t]*(?:export[ \t]+)?(?:default[ \t]+)?(?:abstract[ \t]+)?class[ \t]+([\w$]+)',
+            r'^[ \t]*(?:export[ \t]+)?(?:const|let|var)[ \t]+([\w$]+)[ \t]*=[ \t]*(?:async[ \t]*)?(?:function\b|\([^()]*\)[ \t]*=>|[\w$]+[ \t]*=>)',
+            r'^[ \t]*(?:export[ \t]+)?(?:interface|type|enum)[ \t]+([\w$]+)']),
+        (('.c', '.h', '.cc', '.cpp', '.cxx', '.hh', '.hpp', '.hxx', '.m', '.mm'), [
+            r'^[ \t]*#[ \t]*define[ \t]+(\w+)',
+            r'^[ \t]*(?:typedef[ \t]+)?(?:struct|class|union|enum)[ \t]+(\w+)[^;\n]*$',
+            r'^(?![ \t]*(?:if|for|while|switch|return|else)\b)[A-Za-z_][\w:<>,*& \t]*?[ \t*&]((?:\w+::)*~?\w+)[ \t]*\([^;{}\n]*\)[^;\n]*$']),
+        (('.go',), [
+            r'^func[ \t]+(?:\([^)]*\)[ \t]*)?(\w+)',
+            r'^[ \t]*type[ \t]+(\w+)']),
+        (('.rs',), [
+            r'^[ \t]*(?:pub(?:\([^)]*\))?[ \t]+)?(?:async[ \t]+)?(?:unsafe[ \t]+)?(?:fn|struct|enum|trait|type|mod|macro_rules!)[ \t]+(\w+)']),
+        (('.java', '.cs', '.kt', '.scala'), [
+            r'^[ \t]*(?:[\w@]+[ \t]+)*(?:class|interface|enum|record|object|trait)[ \t]+(\w+)',
+            r'^[ \t]*(?:(?:public|private|protected|internal|static|final|abstract|override|virtual|async|synchronized)[ \t]+)+[\w<>\[\],. ?]+?[ \t]+(\w+)[ \t]*\(',
+            r'^[ \t]*(?:[\w]+[ \t]+)*fun[ \t]+(?:<[^>]*>[ \t]*)?(?:\w+\.)?(\w+)',
+            r'^[ \t]*def[ \t]+(\w+)']),
+        (('.rb',), [
+            r'^[ \t]*def[ \t]+(?:self\.)?(\w+[?!=]?)',
+            r'^[ \t]*(?:class|module)[ \t]+(?:\w+::)*(\w+)']),
+        (('.php',), [
+            r'\bfunction[ \t]+&?(\w+)',
+            r'^[ \t]*(?:abstract[ \t]+|final[ \t]+)?(?:class|interface|trait)[ \t]+(\w+)']),
+        (('.lua',), [
+            r'^[ \t]*(?:local[ \t]+)?function[ \t]+(?:[\w.]+[.:])?(\w+)']),
+        (('.sh', '.bash', '.zsh'), [
+            r'^[ \t]*(?:function[ \t]+)?([\w-]+)[ \t]*\(\)']),
+    ]
+
+    # file extension to the compiled patterns of its language
+    extractors = {
+        extension: [re.compile(pattern, re.MULTILINE) for pattern in patterns]
+        for extensions, patterns in PATTERNS
+        for extension in extensions}
+
+    MAX_FILE_SIZE = 1024 * 1024
+    RESCAN_INTERVAL = 60
+    COMMIT_FILES = 200
+
+    lock = threading.Lock()
+
+    missing_sqlite_reported = False
+
+    # folder to the time it was last scanned, and the folders being scanned
+    scanned = {}
+    scanning = set()
+
+    @classmethod
+    def is_enabled(cls, settings):
+        if not settings.get('fallback_symbol_index', False):
+            return False
+
+        if sqlite3 is None:
+            if not cls.missing_sqlite_reported:
+                cls.missing_sqlite_reported = True
+                print("[symbol] fallback_symbol_index is enabled, but the sqlite3 module "
+                      "is not available to plugins on this Sublime Text build")
+            return False
+
+        return True
+
+    @staticmethod
+    def database_path():
+        return os.path.join(sublime.cache_path(), "symbol_index.sqlite")
+
+    @classmethod
+    def connect(cls):
+        connection = sqlite3.connect(cls.database_path(), timeout=10)
+        connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, mtime REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS symbols (name TEXT, path TEXT, row INTEGER, col INTEGER)")
+        connection.execute("CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name)")
+        connection.execute("CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path)")
+        connection.execute("CREATE INDEX IF NOT EXISTS files_folder ON files (folder)")
+        return connection
+
+    @classmethod
+    def lookup(cls, window, symbol):
+        """ Returns the locations of the symbol definitions on the window folders """
+        view = window.active_view()
+        settings = view.settings() if view else sublime.load_settings('Preferences.sublime-settings')
+        folders = window.folders()
+
+        if not folders or not cls.is_enabled(settings):
+            return []
+
+        cls.schedule_scan(window, folders, settings)
+
+        try:
+            connection = cls.connect()
+            try:
+                rows = connection.execute(
+                    "SELECT path, row, col FROM symbols WHERE name = ? ORDER BY path, row", (symbol,)).fetchall()
+            finally:
+                connection.close()
+
+        except sqlite3.Error as error:
+            print("[symbol] Could not read the fallback symbol index:", error)
+            return []
+
+        locations = []
+        for path, row, col in rows:
+            for folder in folders:
+                if path.startswith(os.path.join(folder, '')):
+                    display_path = os.path.join(os.path.basename(folder), os.path.relpath(path, folder))
+                    locations.append((path, display_path, (row, col)))
+                    break
+
+        return locations
+
+    @classmethod
+    def schedule_scan(cls, window, folders, settings):
+        now = time.time()
+
+        with cls.lock:
+            stale = [folder for folder in folders if folder not in cls.scanning and
+                     now - cls.scanned.get(folder, 0) > cls.RESCAN_INTERVAL]
+            cls.scanning.update(stale)
+
+        if stale:
+            threading.Thread(
+                target=cls.scan,
+                args=(window.id(), stale,
+                      settings.get('folder_exclude_patterns', []),
+                      settings.get('file_exclude_patterns', []) + settings.get('index_exclude_patterns', []))
+            ).start()
+
+    @classmethod
+    def scan(cls, window_id, folders, folder_exclude_patterns, file_exclude_patterns):
+        changed = False
+        try:
+            connection = cls.connect()
+            try:
+                for folder in folders:
+                    if cls.scan_folder(connection, folder, folder_exclude_patterns, file_exclude_patterns):
+                        changed = True
+
+                    with cls.lock:
+                        cls.scanned[folder] = time.time()
+            finally:
+                connection.close()
+
+        except sqlite3.Error as error:
+            print("[symbol] Could not update the fallback symbol index:", error)
+            # some files may have been committed before the error
+            changed = True
+
+        finally:
+            with cls.lock:
+                cls.scanning.difference_update(folders)
+
+        # forget the definitions not found while the index was incomplete
+        if changed:
+            symbol_caches.pop(window_id, None)
+
+    @classmethod
+    def scan_folder(cls, connection, folder, folder_exclude_patterns, file_exclude_patterns):
+        """ Returns whether any file was indexed or deleted """
+        def is_excluded(name, patterns):
+            return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+        indexed = dict(connection.execute("SELECT path, mtime FROM files WHERE folder = ?", (folder,)))
+        seen = set()
+        changed = 0
+
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [name for name in dirs if not is_excluded(name, folder_exclude_patterns)]
+
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in cls.extractors:
+                    continue
+
+                if is_excluded(name, file_exclude_patterns):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if stat.st_size > cls.MAX_FILE_SIZE:
+                    continue
+
+                seen.add(path)
+                if indexed.get(path) != stat.st_mtime:
+                    cls.index_file(connection, folder, path, stat.st_mtime)
+                    changed += 1
+
+                    if changed % cls.COMMIT_FILES == 0:
+                        connection.commit()
+
+        deleted = indexed.keys() - seen
+        for path in deleted:
+            connection.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+        connection.commit()
+        return changed > 0 or len(deleted) > 0
+
+    @classmethod
+    def index_file(cls, connection, folder, path, mtime):
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as source_file:
+                text = source_file.read()
+        except OSError:
+            return
+
+        line_starts = [0]
+        line_starts.extend(match.end() for match in re.finditer('\n', text))
+
+        symbols = []
+        for pattern in cls.extractors[os.path.splitext(path)[1].lower()]:
+            for match in pattern.finditer(text):
+                start = match.start(1)
+                row = bisect.bisect_right(line_starts, start)
+                symbols.append((match.group(1), path, row, start - line_starts[row - 1] + 1))
+
+        connection.execute("DELETE FROM symbols WHERE path = ?", (path,))
+        connection.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?)", symbols)
+        connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, folder, mtime))
+
+    @classmethod
+    def update_file(cls, path):
+        """ Reindexes a saved file, if it is on a scanned folder """
+        with cls.lock:
+            folders = [folder for folder in cls.scanned if path.startswith(os.path.join(folder, ''))]
+
+        if not folders or os.path.splitext(path)[1].lower() not in cls.extractors:
+            return
 
+        try:
+            connection = cls.connect()
+            try:
+                cls.index_file(connection, folders[0], path, os.stat(path).st_mtime)
+                connection.commit()
+            finally:
+                connection.close()
+
+        except (OSError, sqlite3.Error) as error:
+            print("[symbol] Could not update the fallback symbol index:", error)
+
+
+def merge_locations(index_locations, open_file_locations):
     # Combine the two lists, overriding results in the index with results
     # from open files, while trying to preserve the order of the files in
     # the index.
+    open_files = {}
+    for l in open_file_locations:
+        open_files.setdefault(l[0], []).append(l)
+
     locations = []
-    ofl_ignore = []
+    merged = set()
     for l in index_locations:
-        if file_in_location_list(l[0], open_file_locations):
-            if not file_in_location_list(l[0], ofl_ignore):
-                for ofl in open_file_locations:
-                    if l[0] == ofl[0]:
-                        locations.append(ofl)
-                        ofl_ignore.append(ofl)
-        else:
+        if l[0] not in open_files:
             locations.append(l)
+        elif l[0] not in merged:
+            locations.extend(open_files[l[0]])
+            merged.add(l[0])
 
-    for ofl in open_file_locations:
-        if not file_in_location_list(ofl[0], ofl_ignore):
-            locations.append(ofl)
+    for l in open_file_locations:
+        if l[0] not in merged:
+            locations.append(l)
 
     return locations
 
 
-def lookup_references(window, symbol):
+def lookup_locations(window, kind, symbol, lookup_in_index, lookup_in_open_files):
     if len(symbol.strip()) < 3:
         return []
 
-    index_locations = window.lookup_references_in_index(symbol)
-    open_file_locations = window.lookup_references_in_open_files(symbol)
+    cache = symbol_caches.setdefault(window.id(), SymbolCache())
+    key = (kind, symbol)
 
-    def file_in_location_list(fname, locations):
-        for l in locations:
-            if l[0] == fname:
-                return True
-        return False
+    locations = cache.get(key)
+    if locations is None:
+        locations = merge_locations(lookup_in_index(symbol), lookup_in_open_files(symbol))
 
-    # Combine the two lists, overriding results in the index with results
-    # from open files, while trying to preserve the order of the files in
-    # the index.
-    locations = []
-    ofl_ignore = []
-    for l in index_locations:
-        if file_in_location_list(l[0], open_file_locations):
-            if not file_in_location_list(l[0], ofl_ignore):
-                for ofl in open_file_locations:
-                    if l[0] == ofl[0]:
-                        locations.append(ofl)
-                        ofl_ignore.append(ofl)
-        else:
-            locations.append(l)
+        if not locations and kind == "definitions":
+            locations = FallbackSymbolIndex.lookup(window, symbol)
+        cache.put(key, locations)
 
-    for ofl in open_file_locations:
-        if not file_in_location_list(ofl[0], ofl_ignore):
-            locations.append(ofl)
+    return list(locations)
 
-    return locations
+
+def lookup_symbol(window, symbol):
+    return lookup_locations(
+        window, "definitions", symbol,
+        window.lookup_symbol_in_index, window.lookup_symbol_in_open_files)
+
+
+def lookup_references(window, symbol):
+    return lookup_locations(
+        window, "references", symbol,
+        window.lookup_references_in_index, window.lookup_references_in_open_files)
 
 
 def symbol_at_point(view, pt):
@@ -149,12 +492,83 @@ def filter_current_symbol(view, point, symbol, locations):
     return new_locations
 
 
+# the locations listed on the hover popup, in total and per file
+POPUP_MAX_LOCATIONS = 10
+POPUP_MAX_FILE_LOCATIONS = 3
+
+POPUP_BODY = """
+    <body id=show-definitions>
+        <style>
+            body {
+                font-family: system;
+            }
+            h1 {
+                font-size: 1.1rem;
+                font-weight: bold;
+                margin: 0 0 0.25em 0;
+            }
+            p {
+                font-size: 1.05rem;
+                margin: 0;
+            }
+        </style>
+        %s
+    </body>
+"""
+
+
+def format_popup_section(title, locations, more_href):
+    """
+    Returns the popup section listing up to POPUP_MAX_LOCATIONS locations, a
+    line per file with its number of locations, and a link to list them all
+    """
+    files = OrderedDict()
+    for l in locations:
+        files.setdefault(l[1], []).append(l)
+
+    lines = []
+    shown = 0
+    for display_fname, file_locations in files.items():
+        if shown == POPUP_MAX_LOCATIONS:
+            break
+
+        if len(file_locations) == 1:
+            l = file_locations[0]
+            lines.append('<a href="%s">%s</a>' % (
+                location_href(l), html.escape(format_location(l))))
+        else:
+            rows = ['<a href="%s">%d</a>' % (location_href(l), l[2][0])
+                    for l in file_locations[:min(POPUP_MAX_FILE_LOCATIONS, POPUP_MAX_LOCATIONS - shown)]]
+            lines.append('%s (%d): %s' % (
+                html.escape(display_fname), len(file_locations), ', '.join(rows)))
+
+        shown += min(len(file_locations), POPUP_MAX_FILE_LOCATIONS, POPUP_MAX_LOCATIONS - shown)
+
+    if len(locations) > shown:
+        lines.append('<a href="%s">%d more…</a>' % (more_href, len(locations) - shown))
+
+    return """
+        <h1>%s:</h1>
+        <p>%s</p>
+    """ % (title, '<br>'.join(lines))
+
+
+# files larger than this are not opened to preview the highlighted location
+PREVIEW_MAX_FILE_SIZE = 4 * 1024 * 1024
+
+
 def navigate_to_symbol(view, symbol, locations):
     # https://github.com/SublimeTextIssues/Core/issues/1482
     window = view.window()
     group, view_index = window.get_view_index(view)
 
+    # bumped by every highlight and the selection, dropping pending previews
+    preview_generation = 0
+
     def select_entry(window, locations, idx, orig_view, orig_sel):
+        nonlocal preview_generation
+        preview_generation += 1
+
         if idx >= 0:
             open_location(window, locations[idx])
         else:
@@ -165,9 +579,32 @@ def navigate_to_symbol(view, symbol, locations):
                 orig_view.show(orig_sel[0])
 
     def highlight_entry(window, locations, idx):
+        nonlocal preview_generation
+        preview_generation += 1
+        generation = preview_generation
+
+        # Only preview the entry the user stops at, when scrolling through them
+        sublime.set_timeout(
+            lambda: preview_entry(window, locations, idx, generation),
+            view.settings().get('goto_definition_preview_delay', 150))
+
+    def preview_entry(window, locations, idx, generation):
+        if generation != preview_generation:
+            return
+
         fname, display_fname, rowcol = locations[idx]
         row, col = rowcol
 
+        if not window.find_open_file(fname):
+            try:
+                too_large = os.path.getsize(fname) > PREVIEW_MAX_FILE_SIZE
+            except OSError:
+                too_large = False
+
+            if too_large:
+                sublime.status_message("Not previewing the large file " + display_fname)
+                return
+
         # Do not use this fix for transient views!!!!!
         # window.set_view_index(view, group, 0)
         window.open_file(
@@ -225,26 +662,134 @@ class GotoReference(sublime_plugin.WindowCommand):
         navigate_to_symbol(v, symbol, locations)
 
 
+class FindReferences(sublime_plugin.WindowCommand):
+    """
+    Lists the references of the symbol at the caret, or the given symbol, on
+    an output panel with the text of their lines, written a batch of files at
+    a time as they are read on the async thread
+    """
+
+    BATCH_FILES = 20
+
+    # bumped by every search, so the previous one stops writing
+    generation = 0
+
+    def run(self, symbol=None):
+        v = self.window.active_view()
+
+        if not symbol and not v:
+            return
+
+        if not symbol:
+            symbol = v.substr(v.word(v.sel()[0]))
+
+        FindReferences.generation += 1
+        generation = FindReferences.generation
+
+        panel = self.window.create_output_panel("references")
+        panel.settings().set("result_file_regex", r"^([^ \t].*):$")
+        panel.settings().set("result_line_regex", r"^ +([0-9]+):")
+        panel.settings().set("line_numbers", False)
+        panel.settings().set("gutter", False)
+        panel.settings().set("scroll_past_end", False)
+        panel.assign_syntax("Packages/Default/Find Results.hidden-tmLanguage")
+
+        # Call create_output_panel a second time after assigning the above
+        # settings, so that it'll be picked up as a result buffer
+        self.window.create_output_panel("references")
+        self.window.run_command("show_panel", {"panel": "output.references"})
+
+        sublime.set_timeout_async(lambda: self.find(panel, symbol, generation), 0)
+
+    def find(self, panel, symbol, generation):
+        locations = lookup_references(self.window, symbol)
+
+        files = OrderedDict()
+        for l in locations:
+            files.setdefault(l[0], []).append(l[2][0])
+
+        self.append(panel, generation, 'Found %d reference%s of "%s" in %d file%s\n\n' % (
+            len(locations), 's' if len(locations) != 1 else '', symbol,
+            len(files), 's' if len(files) != 1 else ''))
+
+        batch = []
+        for index, (fname, rows) in enumerate(files.items()):
+            if generation != FindReferences.generation:
+                return
+
+            lines = self.read_lines(fname)
+            batch.append(fname + ":\n")
+
+            for row in sorted(set(rows)):
+                text = lines[row - 1] if 0 < row <= len(lines) else ""
+                batch.append("%5d: %s\n" % (row, text))
+            batch.append("\n")
+
+            if (index + 1) % self.BATCH_FILES == 0:
+                self.append(panel, generation, "".join(batch))
+                batch = []
+
+        if batch:
+            self.append(panel, generation, "".join(batch))
+
+    def read_lines(self, fname):
+        """ Returns the lines of the file, from its view if it is open """
+        view = self.window.find_open_file(fname)
+        if view:
+            return view.substr(sublime.Region(0, view.size())).split("\n")
+
+        try:
+            with open(fname, 'r', encoding='utf-8', errors='replace') as source_file:
+                return source_file.read().split("\n")
+        except OSError:
+            return []
+
+    def append(self, panel, generation, characters):
+        def append():
+            if generation == FindReferences.generation:
+                panel.run_command(
+                    'append',
+                    {'characters': characters, 'force': True, 'scroll_to_end': False})
+
+        sublime.set_timeout(append, 0)
+
+
 class ContextGotoDefinitionCommand(sublime_plugin.TextCommand):
     def run(self, edit, event):
-        pt = self.view.window_to_text((event["x"], event["y"]))
-
-        symbol, locations = symbol_at_point(self.view, pt)
+        symbol, locations = self.symbol_at_event(event)
+        ContextEventCache.clear()
 
         navigate_to_symbol(self.view, symbol, locations)
 
     def is_visible(self, event):
-        pt = self.view.window_to_text((event["x"], event["y"]))
-        symbol, locations = symbol_at_point(self.view, pt)
+        symbol, locations = self.symbol_at_event(event)
 
         return len(locations) > 0
 
+    def symbol_at_event(self, event):
+        def resolve():
+            pt = self.view.window_to_text((event["x"], event["y"]))
+            return symbol_at_point(self.view, pt)
+
+        return ContextEventCache.get(self.view, event, "symbol_at_point", resolve)
+
     def want_event(self):
         return True
 
 
 class ShowDefinitions(sublime_plugin.EventListener):
+    """
+    Shows the definitions and references of the hovered symbol, looking them
+    up on the async thread. Hovering again, or editing the view, drops the
+    pending lookup.
+    """
+    hover_generation = 0
+
     def on_hover(self, view, point, hover_zone):
+        # Any hover, even where no popup is shown, drops the pending lookup
+        ShowDefinitions.hover_generation += 1
+        generation = ShowDefinitions.hover_generation
+
         window = view.window() or sublime.active_window()
         if not view.settings().get('show_definitions'):
             return
@@ -270,80 +815,193 @@ class ShowDefinitions(sublime_plugin.EventListener):
             if score('string') and not score('string source'):
                 return
 
+        change_count = view.change_count()
+
+        def is_current():
+            # a newer hover, or an edit, makes this one stale
+            return generation == ShowDefinitions.hover_generation and \
+                view.is_valid() and view.change_count() == change_count
+
+        sublime.set_timeout_async(
+            lambda: self.lookup_definitions(view, window, point, is_current), 0)
+
+    def lookup_definitions(self, view, window, point, is_current):
+        if not is_current():
+            return
+
         symbol, locations = symbol_at_point(view, point)
         locations = filter_current_symbol(view, point, symbol, locations)
-        ref_locations = lookup_references(view.window(), symbol)
+
+        if not is_current():
+            return
+
+        ref_locations = lookup_references(window, symbol)
         ref_locations = filter_current_symbol(view, point, symbol, ref_locations)
         if not locations and not ref_locations:
             return
 
-        links = []
-        for l in locations:
-            links.append('<a href="%s">%s</a>' % (
-                location_href(l), format_location(l)))
-        links = '<br>'.join(links)
-        plural = 's' if len(locations) > 1 else ''
-
-        ref_links = []
-        for l in ref_locations:
-            ref_links.append('<a href="%s">%s</a>' % (
-                location_href(l), format_location(l)))
-        ref_plural = 's' if len(ref_links) != 1 else ''
-        ref_links = '<br>'.join(ref_links)
-
         def on_navigate(href):
+            if href.startswith("more:"):
+                # list all of them on a quick panel
+                view.hide_popup()
+                more = locations if href == "more:definitions" else ref_locations
+                navigate_to_symbol(view, symbol, more)
+                return
+
             # https://github.com/SublimeTextIssues/Core/issues/1482
-            view = window.active_view()
-            group, view_index = window.get_view_index(view)
+            active_view = window.active_view()
+            group, view_index = window.get_view_index(active_view)
 
-            window.set_view_index(view, group, 0)
-            view.window().open_file(
+            window.set_view_index(active_view, group, 0)
+            window.open_file(
                 href,
                 sublime.ENCODED_POSITION | sublime.FORCE_GROUP)
-            window.set_view_index(view, group, view_index)
+            window.set_view_index(active_view, group, view_index)
 
+        sections = []
         if len(locations) > 0:
-            def_section = """
-                <h1>Definition%s:</h1>
-                <p>%s</p>
-            """ % (plural, links)
-        else:
-            def_section = ""
+            plural = 's' if len(locations) > 1 else ''
+            sections.append(format_popup_section("Definition" + plural, locations, "more:definitions"))
 
         if len(ref_locations) > 0:
-            ref_section = """
-                <h1>Reference%s:</h1>
-                <p>%s</p>
-            """ % (ref_plural, ref_links)
-            if len(def_section) != 0:
-                ref_section = "<br>" + ref_section
-        else:
-            ref_section = ""
-
-        body = """
-            <body id=show-definitions>
-                <style>
-                    body {
-                        font-family: system;
-                    }
-                    h1 {
-                        font-size: 1.1rem;
-                        font-weight: bold;
-                        margin: 0 0 0.25em 0;
-                    }
-                    p {
-                        font-size: 1.05rem;
-                        margin: 0;
-                    }
-                </style>
-                %s
-                %s
-            </body>
-        """ % (def_section, ref_section)
-
-        view.show_popup(
-            body,
-            flags=sublime.HIDE_ON_MOUSE_MOVE_AWAY,
-            location=point,
-            on_navigate=on_navigate,
-            max_width=1024)
+            ref_plural = 's' if len(ref_locations) != 1 else ''
+            sections.append(format_popup_section("Reference" + ref_plural, ref_locations, "more:references"))
+
+        body = POPUP_BODY % '<br>'.join(sections)
+
+        def show_popup():
+            if is_current():
+                view.show_popup(
+                    body,
+                    flags=sublime.HIDE_ON_MOUSE_MOVE_AWAY,
+                    location=point,
+                    on_navigate=on_navigate,
+                    max_width=1024)
+
+        sublime.set_timeout(show_popup, 0)
+
+
+class SymbolCacheListener(sublime_plugin.EventListener):
+    """
+    Forgets the cached symbols of the files being edited, the symbols on the
+    edited lines, which may now be defined or referenced there, and the ones
+    found nowhere. Saving a file forgets the whole cache of its window, as
+    symbols may have been defined anywhere in it.
+    """
+
+    # Characters around each caret searched for the edited symbols, as the
+    # lines of minified files may be megabytes long
+    EDITED_SPAN = 100
+
+    def on_modified_async(self, view):
+        window = view.window()
+        cache = window and symbol_caches.get(window.id())
+        if not cache or view.settings().get('is_widget'):
+            return
+
+        symbols = set()
+        for region in view.sel():
+            for point in {region.begin(), region.end()}:
+                span = sublime.Region(max(0, point - self.EDITED_SPAN), min(view.size(), point + self.EDITED_SPAN))
+                symbols.update(re.findall(r'\w+', view.substr(span)))
+
+        path = view.file_name()
+        if not path:
+            cache.invalidate_untitled()
+
+        cache.invalidate(path, symbols)
+        cache.invalidate_empty()
+
+    def on_post_save(self, view):
+        window = view.window()
+        if window:
+            symbol_caches.pop(window.id(), None)
+
+    def on_post_save_async(self, view):
+        if view.file_name() and FallbackSymbolIndex.is_enabled(view.settings()):
+            FallbackSymbolIndex.update_file(view.file_name())
+
+
+class SymbolPrefetcher(sublime_plugin.EventListener):
+    """
+    Looks up the definitions and references of the words in the visible region
+    of the active view on the async thread, once the view stays idle, filling
+    the symbol cache for the hover popups. Each idle tick resolves a bounded
+    batch of words, so other async work is not held back.
+    """
+
+    IDLE_DELAY = 500
+    BATCH_SIZE = 10
+    MAX_WORDS = 100
+
+    generation = 0
+
+    def on_activated_async(self, view):
+        self.schedule(view)
+
+    def on_modified_async(self, view):
+        self.schedule(view)
+
+    def on_selection_modified_async(self, view):
+        self.schedule(view)
+
+    def schedule(self, view):
+        settings = view.settings()
+        if not settings.get('show_definitions_prefetch') or not settings.get('show_definitions'):
+            return
+
+        if settings.get('is_widget'):
+            return
+
+        SymbolPrefetcher.generation += 1
+        generation = SymbolPrefetcher.generation
+
+        def prefetch():
+            if generation == SymbolPrefetcher.generation:
+                self.prefetch(view, generation, self.visible_words(view))
+
+        sublime.set_timeout_async(prefetch, self.IDLE_DELAY)
+
+    def visible_words(self, view):
+        region = view.visible_region()
+        words = []
+        seen = set()
+
+        for match in re.finditer(r'[A-Za-z_$][\w$]{2,}', view.substr(region)):
+            word = match.group()
+            if word in seen:
+                continue
+            seen.add(word)
+
+            pt = region.begin() + match.start()
+            if not view.score_selector(pt, 'source') or view.score_selector(pt, 'comment'):
+                continue
+
+            words.append(word)
+            if len(words) == self.MAX_WORDS:
+                break
+
+        return words
+
+    def prefetch(self, view, generation, words):
+        window = view.window()
+        if not window or not view.is_valid():
+            return
+
+        cache = symbol_caches.setdefault(window.id(), SymbolCache())
+        batch = 0
+
+        while words and batch < self.BATCH_SIZE:
+            word = words.pop(0)
+
+            if not cache.contains(("definitions", word)) or not cache.contains(("references", word)):
+                lookup_symbol(window, word)
+                lookup_references(window, word)
+                batch += 1
+
+        if words:
+            def prefetch_next():
+                if generation == SymbolPrefetcher.generation:
+                    self.prefetch(view, generation, words)
+
+            sublime.set_timeout_async(prefetch_next, self.IDLE_DELAY)
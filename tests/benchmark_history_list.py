@@ -0,0 +1,70 @@
+"""
+Times pushing, jumping, trimming and removing views on the jump history,
+outside of Sublime Text, with:
+python -m tests.benchmark_history_list [operations ...]
+"""
+
+import sys
+import time
+
+from . import fakes
+fakes.install()
+
+from history_list import JumpHistory  # noqa: E402
+from .fakes import Region, View  # noqa: E402
+
+
+def benchmark(sizes=(10000, 100000), view_count=10):
+    """ Prints how long pushing, jumping, trimming and removing views take """
+    for size in sizes:
+        views = [View(index) for index in range(view_count)]
+        history = JumpHistory()
+
+        def push(index):
+            view = views[index % view_count]
+            view.set_sel(Region(index * 10))
+            history.push_selection(view)
+
+        def timed(name, operation):
+            started = time.perf_counter()
+            operation()
+            print("%7d %-7s %9.1f ms" % (size, name, (time.perf_counter() - started) * 1000))
+
+        def push_all():
+            # start a new history before filling it, so nothing is trimmed
+            nonlocal history
+            for index in range(size):
+                if history.len() == JumpHistory.LIST_LIMIT:
+                    history.release_entries()
+                    history = JumpHistory()
+                push(index)
+
+        def trim_all():
+            # the history is full, so every push trims the oldest entry
+            for index in range(size):
+                push(JumpHistory.LIST_LIMIT + index)
+
+        def jump_all():
+            backwards = True
+            for index in range(size):
+                jump = history.jump_back if backwards else history.jump_forward
+                if jump(views[0])[1] == []:
+                    backwards = not backwards
+
+        def remove_all():
+            history.current = None
+            for index in range(size):
+                view = View(view_count + index)
+                view.set_sel(Region(index * 10))
+                history.push_selection(view)
+                history.remove_view(view.view_id)
+
+        timed("push", push_all)
+        timed("trim", trim_all)
+        timed("jump", jump_all)
+        timed("remove", remove_all)
+        history.release_entries()
+
+
+if __name__ == "__main__":
+    benchmark([int(size) for size in sys.argv[1:]] or (10000, 100000))
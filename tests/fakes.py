@@ -0,0 +1,119 @@
+"""
+Small stand-ins for the sublime and sublime_plugin modules, so the plugins
+can be imported and tested outside of Sublime Text, and a fake View
+"""
+
+import sys
+import types
+
+
+class Region(object):
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return "Region(%d, %d)" % (self.a, self.b)
+
+
+class Selection(list):
+    pass
+
+
+def install():
+    """ Registers the stand-ins, unless running inside Sublime Text """
+    try:
+        import sublime  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    sublime = types.ModuleType("sublime")
+    sublime.Region = Region
+    sublime.Selection = Selection
+    sublime.HIDDEN = 128
+    sublime.KEEP_OPEN_ON_FOCUS_LOST = 2
+    sublime.cache_path = lambda: ""
+    sublime.set_timeout = lambda callback, delay=0: None
+    sublime.set_timeout_async = lambda callback, delay=0: None
+    sublime.status_message = lambda message: None
+
+    sublime_plugin = types.ModuleType("sublime_plugin")
+    sublime_plugin.EventListener = type("EventListener", (object,), {})
+    sublime_plugin.TextCommand = type("TextCommand", (object,), {})
+    sublime_plugin.WindowCommand = type("WindowCommand", (object,), {})
+
+    sys.modules["sublime"] = sublime
+    sys.modules["sublime_plugin"] = sublime_plugin
+
+
+class View(object):
+    """ A fake view, whose selection is a list with a single region """
+
+    def __init__(self, id, file_name=None):
+        self.view_id = id
+        # just make it a list of regions
+        self.region_list = [Region(0, 0)]
+        self.key_to_region = {}
+        self.path = file_name
+        self.changes = 0
+
+    def id(self):
+        return self.view_id
+
+    def file_name(self):
+        return self.path
+
+    def name(self):
+        return ""
+
+    def change_count(self):
+        return self.changes
+
+    def viewport_position(self):
+        return (0, 0)
+
+    def rowcol(self, point):
+        # every line is 10 characters long
+        return (point // 10, point % 10)
+
+    def line(self, point):
+        return Region(point, point)
+
+    def substr(self, region):
+        return ""
+
+    def sel(self):
+        return self.region_list
+
+    def set_sel(self, region):
+        self.region_list = [region]
+
+    def add_regions(self, key, regions, *args):
+        self.key_to_region[key] = regions
+
+    def get_regions(self, key):
+        return self.key_to_region.get(key, [])
+
+    def erase_regions(self, key):
+        del self.key_to_region[key]
+
+    def insert(self, point, length):
+        """ Inserts length characters at point, moving the regions after it """
+        self.changes += 1
+
+        def move(position):
+            return position + length if position >= point else position
+
+        for key, regions in self.key_to_region.items():
+            self.key_to_region[key] = [Region(move(region.a), move(region.b)) for region in regions]
@@ -0,0 +1,205 @@
+"""
+The jump history tests, run outside of Sublime Text with:
+python -m unittest tests.test_history_list
+or
+python -m pytest tests
+"""
+
+import unittest
+
+from . import fakes
+fakes.install()
+
+from history_list import JumpHistory, RegionsManager, jump_entries  # noqa: E402
+from .fakes import Region, View  # noqa: E402
+
+
+class JumpHistoryTest(unittest.TestCase):
+
+    def test_simple_jump(self):
+        history = JumpHistory()
+        view = View(1)
+
+        # create a new selection
+        first_pos = Region(10, 10)
+        view.set_sel(first_pos)
+
+        # push
+        history.push_selection(view)
+
+        # go some where
+        second_pos = Region(20, 10)
+        view.set_sel(second_pos)
+
+        # now try to jump back
+        # should jump back to first pos
+        self.assertEqual(history.jump_back(view)[1][0], first_pos)
+
+        # now jump back again, should go no where
+        self.assertEqual(history.jump_back(view)[1], [])
+
+        # jump forward, should jump to where we were, this also test
+        # that second_pos is automatically pushed when we jump back
+        # from a new position
+        self.assertEqual(history.jump_forward(view)[1][0], second_pos)
+
+    # try to jump back two step and set new history
+    def test_jump_branch(self):
+        history = JumpHistory()
+        view = View(1)
+
+        # create 3 jump positions
+        pos_1 = Region(1, 1)
+        view.set_sel(pos_1)
+        history.push_selection(view)
+
+        pos_2 = Region(2, 2)
+        view.set_sel(pos_2)
+        history.push_selection(view)
+
+        pos_3 = Region(3, 3)
+        view.set_sel(pos_3)
+        history.push_selection(view)
+
+        pos_4 = Region(4, 4)
+        view.set_sel(pos_4)
+
+        # now jump back to pos_2, and do few moves
+        self.assertEqual(history.jump_back(view)[1][0], pos_3)
+        self.assertEqual(history.jump_back(view)[1][0], pos_2)
+
+        pos_3 = Region(3, 1)
+        view.set_sel(pos_3)
+        history.push_selection(view)
+
+        pos_4 = Region(4, 1)
+        view.set_sel(pos_4)
+        history.push_selection(view)
+
+        # now if I do a jump back i should get to pos_3
+        self.assertEqual(history.jump_back(view)[1][0], pos_3)
+
+        # back two more step should get to pos_1, show that history
+        # before pos_2 is still there
+        self.assertEqual(history.jump_back(view)[1][0], pos_2)
+        self.assertEqual(history.jump_back(view)[1][0], pos_1)
+
+        # test jumping forward again
+        self.assertEqual(history.jump_forward(view)[1][0], pos_2)
+        self.assertEqual(history.jump_forward(view)[1][0], pos_3)
+
+    # test case where some jump history points are dups
+    def test_duplicate_jump_history(self):
+        history = JumpHistory()
+        view = View(1)
+
+        # create a new selection
+        first_pos = Region(10, 10)
+        view.set_sel(first_pos)
+
+        history.push_selection(view)
+        history.push_selection(view)
+
+        # go some where
+        second_pos = Region(20, 10)
+        view.set_sel(second_pos)
+        history.push_selection(view)
+        history.push_selection(view)
+
+        # now jump back, should jump back to first pos
+        # and ignore the previous two pushes
+        self.assertEqual(history.jump_back(view)[1][0], first_pos)
+
+        # now jump back again, should go no where
+        self.assertEqual(history.jump_back(view)[1], [])
+
+        # jump forward would still jump to second_pos
+        self.assertEqual(history.jump_forward(view)[1][0], second_pos)
+
+        # jump forward again would go no where
+        self.assertEqual(history.jump_forward(view)[1], [])
+
+    def test_trim_at_limit(self):
+        history = JumpHistory()
+        view = View(1)
+
+        for index in range(JumpHistory.LIST_LIMIT + 10):
+            view.set_sel(Region(index))
+            history.push_selection(view)
+
+        # the oldest entries are dropped once the limit is reached
+        self.assertEqual(history.len(), JumpHistory.LIST_LIMIT)
+
+        selections = []
+        region_list = history.jump_back(view)[1]
+        while region_list != []:
+            selections.append(region_list[0])
+            region_list = history.jump_back(view)[1]
+
+        self.assertEqual(len(selections), JumpHistory.LIST_LIMIT - 1)
+        self.assertEqual(selections[0], Region(JumpHistory.LIST_LIMIT + 8))
+        self.assertEqual(selections[-1], Region(10))
+
+    def test_remove_view(self):
+        history = JumpHistory()
+        view_1 = View(1)
+        view_2 = View(2)
+
+        for view, point in ((view_1, 1), (view_2, 2), (view_1, 3), (view_2, 4)):
+            view.set_sel(Region(point))
+            history.push_selection(view)
+
+        history.remove_view(view_2.view_id)
+        self.assertEqual(history.len(), 2)
+
+        view_1.set_sel(Region(5))
+        self.assertEqual(history.jump_back(view_1)[1][0], Region(3))
+        self.assertEqual(history.jump_back(view_1)[1][0], Region(1))
+        self.assertEqual(history.jump_back(view_1)[1], [])
+
+    def test_shared_entries(self):
+        window_history = JumpHistory()
+        view_history = JumpHistory()
+        view = View(1)
+
+        view.set_sel(Region(10))
+        window_history.push_selection(view)
+        view_history.push_selection(view)
+
+        # both histories reference the same entry
+        entry = window_history.slot(window_history.end - 1)
+        self.assertEqual(view_history.slot(view_history.end - 1), entry)
+        self.assertEqual(jump_entries.references[entry], 2)
+
+        window_history.remove_view(view.view_id)
+        self.assertEqual(view_history.jump_back(view)[1], [])
+        self.assertEqual(jump_entries.selection(entry), [Region(10)])
+
+        view_history.release_entries()
+        self.assertEqual(jump_entries.references[entry], 0)
+        self.assertEqual(jump_entries.selection(entry), [])
+
+    def test_edits_move_entries(self):
+        history = JumpHistory()
+        view = View(1)
+
+        for index in range(RegionsManager.BLOCK_SIZE):
+            view.set_sel(Region(10 + index * 10))
+            history.push_selection(view)
+
+        # the stored positions follow the text inserted before them
+        view.insert(15, 5)
+        view.set_sel(Region(5000))
+
+        self.assertEqual(history.jump_back(view)[1][0], Region(RegionsManager.BLOCK_SIZE * 10 + 5))
+
+        for index in range(RegionsManager.BLOCK_SIZE - 3):
+            history.jump_back(view)
+        self.assertEqual(history.jump_back(view)[1][0], Region(25))
+        self.assertEqual(history.jump_back(view)[1][0], Region(10))
+        self.assertEqual(history.jump_back(view)[1], [])
+
+    def test_benchmark(self):
+        # a short run, so the benchmark keeps working as JumpHistory changes
+        from .benchmark_history_list import benchmark
+        benchmark((JumpHistory.LIST_LIMIT * 2,))